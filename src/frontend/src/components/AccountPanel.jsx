@@ -1,10 +1,58 @@
-import React, { useState } from "react";
+import React, { useEffect, useMemo, useRef, useState } from "react";
 import { apiGet, apiPost } from "../api.js";
 
 export default function AccountPanel({ userId }) {
   const [balance, setBalance] = useState(null);
   const [topupAmount, setTopupAmount] = useState("100.00");
   const [err, setErr] = useState("");
+  const versionRef = useRef(-1);
+
+  const wsUrl = useMemo(() => {
+    const proto = window.location.protocol === "https:" ? "wss" : "ws";
+    return `${proto}://${window.location.host}/ws/accounts/balance?user_id=${encodeURIComponent(userId)}`;
+  }, [userId]);
+
+  useEffect(() => {
+    if (!userId) return;
+
+    let closed = false;
+    let reconnectTimer = null;
+    let ws = null;
+
+    function connect() {
+      // Every connection starts with a fresh snapshot.
+      versionRef.current = -1;
+      ws = new WebSocket(wsUrl);
+
+      ws.onmessage = (ev) => {
+        try {
+          const msg = JSON.parse(ev.data);
+          if (msg?.type === "ping") {
+            ws.send(JSON.stringify({ type: "pong" }));
+            return;
+          }
+          if ((msg?.type === "snapshot" || msg?.type === "delta") && msg.version > versionRef.current) {
+            versionRef.current = msg.version;
+            setBalance(msg.balance);
+          }
+        } catch (_) {}
+      };
+
+      ws.onclose = (ev) => {
+        if (closed || ev.code === 1000 || ev.code === 1008) return;
+        // 1013: connection cap hit, 1012: server lost the change feed
+        reconnectTimer = setTimeout(connect, ev.code === 1013 ? 10000 : 1000);
+      };
+    }
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
+      try { ws?.close(); } catch (_) {}
+    };
+  }, [userId, wsUrl]);
 
   async function refresh() {
     setErr("");
@@ -30,7 +78,8 @@ export default function AccountPanel({ userId }) {
     setErr("");
     try {
       const data = await apiPost("/accounts/topup", userId, { amount: topupAmount });
-      setBalance(data.balance);
+      // The stream delivers the same change; don't let a late response undo a newer debit.
+      if (versionRef.current < 0) setBalance(data.balance);
     } catch (e) {
       setErr(String(e));
     }
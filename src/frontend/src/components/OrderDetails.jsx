@@ -15,6 +15,7 @@ export default function OrderDetails({ userId, orderId }) {
   const [order, setOrder] = useState(null);
   const [err, setErr] = useState("");
   const wsRef = useRef(null);
+  const lastSeqRef = useRef(null);
 
   async function refresh() {
     setErr("");
@@ -39,16 +40,48 @@ export default function OrderDetails({ userId, orderId }) {
       Notification.requestPermission().catch(() => {});
     }
 
-    const ws = new WebSocket(wsUrl);
-    wsRef.current = ws;
+    let closed = false;
+    let reconnectTimer = null;
+    lastSeqRef.current = null;
 
-    ws.onopen = () => {
-      toast.info("WebSocket подключен: отслеживание статуса заказа");
-    };
+    function connect() {
+      const url = lastSeqRef.current === null ? wsUrl : `${wsUrl}&last_seq=${lastSeqRef.current}`;
+      const ws = new WebSocket(url);
+      wsRef.current = ws;
+
+      ws.onopen = () => {
+        toast.info("WebSocket подключен: отслеживание статуса заказа");
+      };
+
+      ws.onmessage = onMessage;
+
+      ws.onerror = () => {
+        toast.error("WebSocket error");
+      };
 
-    ws.onmessage = (ev) => {
+      ws.onclose = (ev) => {
+        if (closed || ev.code === 1000) return;
+        toast.warn("WebSocket закрыт");
+        // 1000: order reached a final status, 1008: rejected, 1013: connection cap hit
+        if (ev.code !== 1008) {
+          reconnectTimer = setTimeout(connect, ev.code === 1013 ? 10000 : 1000);
+        }
+      };
+    }
+
+    function onMessage(ev) {
       try {
         const msg = JSON.parse(ev.data);
+        if (msg?.type === "ping") {
+          ev.target.send(JSON.stringify({ type: "pong" }));
+          return;
+        }
+        if (typeof msg?.seq === "number") {
+          const last = lastSeqRef.current;
+          const stale = last !== null && (msg.type === "snapshot" ? msg.seq < last : msg.seq <= last);
+          if (stale) return;
+          lastSeqRef.current = Math.max(last ?? 0, msg.seq);
+        }
         if (msg?.type === "snapshot") {
           setOrder((prev) => prev ? { ...prev, status: msg.status } : prev);
           return;
@@ -61,18 +94,14 @@ export default function OrderDetails({ userId, orderId }) {
           notify("Гоzон: статус заказа", text);
         }
       } catch (_) {}
-    };
-
-    ws.onerror = () => {
-      toast.error("WebSocket error");
-    };
+    }
 
-    ws.onclose = () => {
-      toast.warn("WebSocket закрыт");
-    };
+    connect();
 
     return () => {
-      try { ws.close(); } catch (_) {}
+      closed = true;
+      clearTimeout(reconnectTimer);
+      try { wsRef.current?.close(); } catch (_) {}
     };
   }, [userId, orderId, wsUrl]);
 
@@ -0,0 +1,133 @@
+import asyncio
+import math
+import time
+
+import redis.asyncio as redis
+from sqlalchemy import func, select
+
+from .config import settings
+from .db import SessionLocal
+from .messaging import QUEUE_PAYMENTS_REQUESTS, MessageTransport, payment_request_queue_name
+from .models import OutboxEvent
+
+
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local data = redis.call('HMGET', key, 'tokens', 'ts')
+    local t = tonumber(data[1]) or burst
+    local ts = tonumber(data[2]) or now
+    t = math.min(burst, t + math.max(0, now - ts) * rate)
+    tokens[i] = t
+    if t < 1 then
+        wait = math.max(wait, (1 - t) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local t = tokens[i]
+    if wait == 0 then
+        t = t - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(t), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return tostring(wait)
+"""
+
+KEY_PREFIX = "admission"
+
+# Readings older than this many sample intervals are ignored, so a sampler
+# that keeps failing fails open instead of pinning the service on 429.
+STALE_AFTER_SAMPLES = 3
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, redis_url: str, rmq: MessageTransport) -> None:
+        self.rmq = rmq
+        self._redis = redis.from_url(redis_url)
+        self._token_bucket = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+        self.outbox_pending: int | None = None
+        self.oldest_pending_age: float | None = None
+        self.queue_depth: int | None = None
+        self.sampled_at: float | None = None
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+    def overloaded(self) -> bool:
+        if self.sampled_at is None:
+            return False
+        if time.monotonic() - self.sampled_at > STALE_AFTER_SAMPLES * settings.admission_sample_interval:
+            return False
+        return (
+            (self.outbox_pending or 0) > settings.admission_max_outbox_pending
+            or (self.oldest_pending_age or 0.0) > settings.admission_max_outbox_age
+            or (self.queue_depth or 0) > settings.admission_max_queue_depth
+        )
+
+    async def admit(self, user_id: str) -> None:
+        if not settings.admission_enabled:
+            return
+        if self.overloaded():
+            raise AdmissionRejected("Order pipeline is overloaded", settings.admission_retry_after)
+
+        try:
+            wait = float(await self._token_bucket(
+                keys=[f"{KEY_PREFIX}:user:{user_id}", f"{KEY_PREFIX}:global"],
+                args=[
+                    settings.admission_user_rate,
+                    settings.admission_user_burst,
+                    settings.admission_global_rate,
+                    settings.admission_global_burst,
+                ],
+            ))
+        except redis.RedisError:
+            return
+        if wait > 0:
+            raise AdmissionRejected("Rate limit exceeded", wait)
+
+    async def _sample_outbox(self) -> None:
+        async with SessionLocal() as session:
+            res = await session.execute(
+                select(func.count(), func.min(OutboxEvent.created_at)).where(
+                    OutboxEvent.published_at.is_(None),
+                    OutboxEvent.attempts < settings.outbox_max_attempts,
+                )
+            )
+            pending, oldest = res.one()
+        self.outbox_pending = pending
+        self.oldest_pending_age = (
+            max(0.0, time.time() - oldest.timestamp()) if oldest is not None else 0.0
+        )
+
+    async def _sample_queue(self) -> None:
+        queue_names = [QUEUE_PAYMENTS_REQUESTS]
+        queue_names += [payment_request_queue_name(shard) for shard in range(settings.payment_request_shards)]
+        self.queue_depth = await self.rmq.queue_depth(*queue_names)
+
+    async def sampler(self) -> None:
+        while True:
+            results = await asyncio.gather(self._sample_outbox(), self._sample_queue(), return_exceptions=True)
+            if not any(isinstance(r, Exception) for r in results):
+                self.sampled_at = time.monotonic()
+
+            await asyncio.sleep(settings.admission_sample_interval)
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
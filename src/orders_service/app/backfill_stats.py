@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from sqlalchemy import text
+
+from .db import SessionLocal, engine
+
+
+logger = logging.getLogger(__name__)
+
+FILL_AMOUNT_VALUES_SQL = text("""
+WITH batch AS (
+    SELECT id, user_id FROM orders
+    WHERE CAST(:after AS uuid) IS NULL OR id > CAST(:after AS uuid)
+    ORDER BY id
+    LIMIT :limit
+),
+filled AS (
+    UPDATE orders o
+    SET amount_value = CAST(o.amount AS numeric)
+    FROM batch b
+    WHERE o.id = b.id AND o.user_id = b.user_id AND o.amount_value IS NULL
+    RETURNING 1
+)
+SELECT (SELECT id FROM batch ORDER BY id DESC LIMIT 1), (SELECT count(*) FROM filled)
+""")
+
+NEXT_USERS_SQL = text("""
+SELECT DISTINCT user_id FROM orders
+WHERE CAST(:after AS varchar) IS NULL OR user_id > CAST(:after AS varchar)
+ORDER BY user_id
+LIMIT :limit
+""")
+
+SEED_STATS_SQL = text("""
+INSERT INTO order_stats (user_id, status, order_count, total_amount, updated_at)
+SELECT u, s, 0, 0, now()
+FROM unnest(CAST(:users AS varchar[])) AS u CROSS JOIN unnest(enum_range(CAST(NULL AS orderstatus))) AS s
+ON CONFLICT (user_id, status) DO NOTHING
+""")
+
+RESET_STATS_SQL = text("""
+UPDATE order_stats SET order_count = 0, total_amount = 0, updated_at = now()
+WHERE user_id = ANY(CAST(:users AS varchar[]))
+""")
+
+RECOMPUTE_STATS_SQL = text("""
+INSERT INTO order_stats (user_id, status, order_count, total_amount, updated_at)
+SELECT user_id, status, count(*), coalesce(sum(COALESCE(amount_value, CAST(amount AS numeric))), 0), now()
+FROM orders
+WHERE user_id = ANY(CAST(:users AS varchar[]))
+GROUP BY user_id, status
+ON CONFLICT (user_id, status) DO UPDATE SET
+    order_count = EXCLUDED.order_count,
+    total_amount = EXCLUDED.total_amount,
+    updated_at = now()
+""")
+
+
+async def fill_amount_values(*, batch_size: int, pause: float) -> int:
+    filled, after = 0, None
+    while True:
+        async with SessionLocal() as session:
+            async with session.begin():
+                last, n = (await session.execute(FILL_AMOUNT_VALUES_SQL, {"after": after, "limit": batch_size})).one()
+        if last is None:
+            return filled
+        filled += n
+        after = str(last)
+        logger.info("amount_value: filled %d rows (last id=%s)", filled, after)
+        await asyncio.sleep(pause)
+
+
+# Every stats row of the batch is seeded and then locked by the reset before
+# the totals are read. Writers upsert the same rows before they commit, so an
+# order is either already visible to the recompute or its delta lands on top
+# of it afterwards; nothing is counted twice or lost.
+async def recompute_stats(*, batch_size: int, pause: float) -> int:
+    users_done, after = 0, None
+    while True:
+        async with SessionLocal() as session:
+            users = list((await session.execute(NEXT_USERS_SQL, {"after": after, "limit": batch_size})).scalars())
+        if not users:
+            return users_done
+
+        async with SessionLocal() as session:
+            async with session.begin():
+                await session.execute(SEED_STATS_SQL, {"users": users})
+                await session.execute(RESET_STATS_SQL, {"users": users})
+                await session.execute(RECOMPUTE_STATS_SQL, {"users": users})
+
+        users_done += len(users)
+        after = users[-1]
+        logger.info("order_stats: recomputed %d users (last user_id=%s)", users_done, after)
+        await asyncio.sleep(pause)
+
+
+async def run(args: argparse.Namespace) -> None:
+    started = time.monotonic()
+    try:
+        filled = await fill_amount_values(batch_size=args.batch_size, pause=args.pause)
+        users = await recompute_stats(batch_size=args.users_per_batch, pause=args.pause)
+    finally:
+        await engine.dispose()
+    print(f"amount_values_filled={filled} users_recomputed={users} elapsed_s={time.monotonic() - started:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill orders.amount_value and recompute order_stats")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Orders per amount_value batch")
+    parser.add_argument("--users-per-batch", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import time
+import uuid
+
+import orjson
+from sqlalchemy import delete, insert
+
+from .crud import list_order_rows, list_orders
+from .db import SessionLocal, init_db
+from .models import Order, OrderStatus
+from .schemas import OrderListResponse
+
+
+async def _seed(user_id: str, rows: int) -> None:
+    async with SessionLocal() as session:
+        async with session.begin():
+            await session.execute(
+                insert(Order.__table__),
+                [
+                    {
+                        "id": uuid.uuid4(),
+                        "user_id": user_id,
+                        "amount": "10.00",
+                        "description": f"bench order {i}",
+                        "status": OrderStatus.NEW,
+                    }
+                    for i in range(rows)
+                ],
+            )
+
+
+async def _cleanup(user_id: str) -> None:
+    async with SessionLocal() as session:
+        async with session.begin():
+            await session.execute(delete(Order.__table__).where(Order.__table__.c.user_id == user_id))
+
+
+async def _orm_path(user_id: str) -> bytes:
+    async with SessionLocal() as session:
+        orders = await list_orders(session, user_id=user_id)
+        return OrderListResponse.model_validate({"orders": orders}).model_dump_json().encode("utf-8")
+
+
+async def _core_path(user_id: str) -> bytes:
+    async with SessionLocal() as session:
+        orders = await list_order_rows(session, user_id=user_id)
+        return orjson.dumps({"orders": orders})
+
+
+async def _measure(fn, user_id: str, repeat: int) -> float:
+    await fn(user_id)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn(user_id)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def run(sizes: list[int], repeat: int) -> None:
+    await init_db()
+    for rows in sizes:
+        user_id = f"bench-{uuid.uuid4()}"
+        await _seed(user_id, rows)
+        try:
+            orm = await _measure(_orm_path, user_id, repeat)
+            core = await _measure(_core_path, user_id, repeat)
+        finally:
+            await _cleanup(user_id)
+        print(f"rows={rows:>6}  orm={orm * 1000:8.2f} ms  core={core * 1000:8.2f} ms  speedup={orm / core:5.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare ORM and Core read paths for GET /orders")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
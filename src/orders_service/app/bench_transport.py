@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Any
+
+from .codec import decode, encode
+from .config import settings
+from .messaging import RabbitMQ
+
+
+BENCH_QUEUE = "bench.transport"
+BENCH_ROUTING_KEY = "bench.transport"
+
+
+# Baseline for the comparison: the smallest broker stand-in that supports what
+# _measure uses, handing messages over through asyncio queues. With
+# confirm_delivery the publisher waits for the consumer's ack, like a broker
+# publisher confirm would.
+class LocalMessage:
+    def __init__(self, *, body: bytes, content_type: str, confirm: asyncio.Future | None) -> None:
+        self.body = body
+        self.content_type = content_type
+        self.confirm = confirm
+
+    async def ack(self) -> None:
+        if self.confirm is not None and not self.confirm.done():
+            self.confirm.set_result(None)
+
+
+class LocalQueue:
+    def __init__(self) -> None:
+        self._messages: asyncio.Queue[LocalMessage] = asyncio.Queue()
+        self._consumers: dict[str, asyncio.Task] = {}
+
+    def put(self, msg: LocalMessage) -> None:
+        self._messages.put_nowait(msg)
+
+    async def consume(self, callback) -> str:
+        async def run() -> None:
+            while True:
+                await callback(await self._messages.get())
+
+        tag = uuid.uuid4().hex
+        self._consumers[tag] = asyncio.create_task(run())
+        return tag
+
+    async def cancel(self, tag: str) -> None:
+        task = self._consumers.pop(tag, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def close(self) -> None:
+        for tag in list(self._consumers):
+            await self.cancel(tag)
+
+
+class InProcessBus:
+    def __init__(self, *, content_type: str, confirm_delivery: bool, delivery_timeout: float = 30.0) -> None:
+        self.content_type = content_type
+        self.confirm_delivery = confirm_delivery
+        self.delivery_timeout = delivery_timeout
+        self._bindings: dict[str, list[LocalQueue]] = {}
+
+    async def connect(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        for queues in self._bindings.values():
+            for queue in queues:
+                await queue.close()
+
+    async def declare_bound_queue(self, queue_name: str, routing_key: str, **_: Any) -> LocalQueue:
+        queue = LocalQueue()
+        self._bindings.setdefault(routing_key, []).append(queue)
+        return queue
+
+    async def publish_json(self, *, routing_key: str, body: dict[str, Any], message_id: str) -> None:
+        loop = asyncio.get_running_loop()
+        data = encode(body, self.content_type)
+        confirms = []
+        for queue in self._bindings.get(routing_key, []):
+            confirm = loop.create_future() if self.confirm_delivery else None
+            queue.put(LocalMessage(body=data, content_type=self.content_type, confirm=confirm))
+            if confirm is not None:
+                confirms.append(confirm)
+        if confirms:
+            await asyncio.wait_for(asyncio.gather(*confirms), self.delivery_timeout)
+
+
+async def _measure(transport: RabbitMQ | InProcessBus, messages: int, concurrency: int, payload_size: int) -> tuple[float, list[float]]:
+    await transport.connect()
+    queue = await transport.declare_bound_queue(BENCH_QUEUE, BENCH_ROUTING_KEY, retry_topology=False)
+    latencies: list[float] = []
+    done = asyncio.Event()
+
+    async def handle(msg) -> None:
+        latencies.append(time.perf_counter() - decode(msg.body, msg.content_type)["sent_at"])
+        await msg.ack()
+        if len(latencies) == messages:
+            done.set()
+
+    slots = asyncio.Semaphore(concurrency)
+    filler = "x" * payload_size
+
+    async def send(i: int) -> None:
+        async with slots:
+            await transport.publish_json(
+                routing_key=BENCH_ROUTING_KEY,
+                body={"i": i, "sent_at": time.perf_counter(), "payload": filler},
+                message_id=str(uuid.uuid4()),
+            )
+
+    tag = await queue.consume(handle)
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(messages)))
+        await done.wait()
+        elapsed = time.perf_counter() - started
+    finally:
+        await queue.cancel(tag)
+        if hasattr(queue, "delete"):
+            await queue.delete(if_unused=False, if_empty=False)
+        await transport.close()
+    return elapsed, sorted(latencies)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(args: argparse.Namespace) -> None:
+    transports: dict[str, RabbitMQ | InProcessBus] = {
+        "inprocess": InProcessBus(content_type=settings.message_content_type, confirm_delivery=False),
+        "inprocess+confirm": InProcessBus(content_type=settings.message_content_type, confirm_delivery=True),
+    }
+    if not args.skip_rabbitmq:
+        transports["rabbitmq"] = RabbitMQ(args.rabbitmq_url, content_type=settings.message_content_type)
+
+    for name, transport in transports.items():
+        elapsed, latencies = await _measure(transport, args.messages, args.concurrency, args.payload_size)
+        print(
+            f"{name:>18}  {args.messages / elapsed:10.0f} msg/s"
+            f"  p50={_percentile(latencies, 0.50) * 1000:8.3f} ms"
+            f"  p99={_percentile(latencies, 0.99) * 1000:8.3f} ms"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare RabbitMQ and in-process message transports")
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=100, help="Publishes in flight at once")
+    parser.add_argument("--payload-size", type=int, default=256)
+    parser.add_argument("--rabbitmq-url", default=settings.rabbitmq_url)
+    parser.add_argument("--skip-rabbitmq", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
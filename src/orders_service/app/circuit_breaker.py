@@ -0,0 +1,41 @@
+import enum
+import time
+
+
+class BreakerState(str, enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, *, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = BreakerState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    def ready(self) -> bool:
+        if self.state != BreakerState.OPEN:
+            return True
+        return time.monotonic() - self._opened_at >= self.reset_timeout
+
+    def allow(self) -> bool:
+        if self.state == BreakerState.CLOSED:
+            return True
+        if self.state == BreakerState.OPEN and self.ready():
+            self.state = BreakerState.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = BreakerState.CLOSED
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == BreakerState.HALF_OPEN or self._failures >= self.failure_threshold:
+            self.state = BreakerState.OPEN
+            self._opened_at = time.monotonic()
@@ -7,11 +7,77 @@ class Settings(BaseSettings):
     service_name: str = "orders"
 
     database_url: str
+    database_replica_url: str | None = None
+    payments_database_url: str | None = None
     rabbitmq_url: str
     redis_url: str
 
+    run_background_workers: bool = True
+    shutdown_drain_timeout: float = 8.0
+
+    user_partitions: int = 0
+
     outbox_poll_interval: float = 1.0
     outbox_batch_size: int = 50
+    outbox_store_debug_payload: bool = False
+    outbox_max_attempts: int = 20
+    outbox_backoff_base: float = 1.0
+    outbox_backoff_max: float = 300.0
+    outbox_breaker_failure_threshold: int = 5
+    outbox_breaker_reset_timeout: float = 10.0
+
+    message_content_type: str = "application/json"
+    payment_request_shards: int = 8
+
+    consumer_max_retries: int = 5
+    consumer_retry_base_delay: float = 1.0
+    payment_result_batch_size: int = 1
+    payment_result_batch_wait: float = 0.05
+
+    admin_token: str | None = None
+
+    long_poll_max_wait: float = 30.0
+
+    admission_enabled: bool = True
+    admission_sample_interval: float = 2.0
+    admission_max_outbox_pending: int = 10000
+    admission_max_outbox_age: float = 60.0
+    admission_max_queue_depth: int = 10000
+    admission_retry_after: float = 5.0
+    admission_user_rate: float = 5.0
+    admission_user_burst: int = 20
+    admission_global_rate: float = 500.0
+    admission_global_burst: int = 1000
+
+    idempotency_key_ttl: int = 86400
+    idempotency_reap_interval: float = 300.0
+
+    reconcile_interval: float = 0.0
+    reconcile_older_than: float = 600.0
+    reconcile_chunk_size: int = 500
+
+    # Optional app-level keep-alive; 0 disables it.
+    ws_ping_interval: float = 20.0
+    ws_send_timeout: float = 5.0
+    ws_max_connections: int = 10000
+    ws_max_per_user: int = 10
+
+    status_stream_maxlen: int = 100
+    status_stream_ttl: int = 86400
+
+    replica_max_lag: float = 5.0
+    replica_lag_check_interval: float = 1.0
+    read_your_writes_window: float = 5.0
+
+    readiness_cache_ttl: float = 2.0
+    readiness_check_timeout: float = 1.0
+
+    loop_monitor_enabled: bool = True
+    loop_monitor_interval: float = 0.25
+    loop_slow_threshold: float = 0.2
+    loop_lag_report_interval: float = 60.0
+    profile_max_seconds: float = 30.0
+    profile_sample_interval: float = 0.005
 
 
 settings = Settings()
@@ -1,58 +1,174 @@
-import json
+import asyncio
+from contextlib import suppress
 from typing import Any
 
-from sqlalchemy.dialects.postgresql import insert
-
+from .codec import decode
+from .config import settings
+from .crud import apply_payment_results
 from .db import SessionLocal
-from .models import InboxMessage, OrderStatus
-from .crud import update_order_status
-from .messaging import RabbitMQ
-from .redis_pubsub import publish_order_status
+from .drain import drain
+from .models import OrderStatus
+from .messaging import QUEUE_ORDERS_PAYMENT_RESULTS, MessageTransport
+from .redis_pubsub import publish_order_statuses
+from .status_waiters import StatusWaiters
+from .websocket_manager import WebSocketManager
+
+
+def _parse_message(msg) -> dict[str, Any]:
+    return decode(msg.body, msg.content_type)
 
 
-def _parse_message(body: bytes) -> dict[str, Any]:
-    return json.loads(body.decode("utf-8"))
+def _parse_payment_result(msg) -> dict[str, Any] | None:
+    payload = _parse_message(msg).get("payload", {})
+    order_id = payload.get("order_id")
+    user_id = payload.get("user_id")
+    payment_status = payload.get("payment_status")
+    if not order_id or not user_id or payment_status not in ("succeeded", "failed"):
+        return None
+    return {
+        "message_id": msg.message_id or "",
+        "order_id": order_id,
+        "user_id": user_id,
+        "status": OrderStatus.FINISHED if payment_status == "succeeded" else OrderStatus.CANCELLED,
+        "payment_status": payment_status,
+        "reason": payload.get("reason"),
+    }
 
 
-async def payment_result_consumer(rmq: RabbitMQ, redis_url: str) -> None:
+async def payment_result_consumer(
+    rmq: MessageTransport,
+    redis_url: str,
+    ws_manager: WebSocketManager | None = None,
+    status_waiters: StatusWaiters | None = None,
+) -> None:
     queue = await rmq.declare_orders_payment_results_queue()
 
+    if settings.payment_result_batch_size > 1:
+        await _consume_batches(rmq, queue, redis_url, ws_manager, status_waiters)
+        return
+
     async with queue.iterator() as q:
-        async for msg in q:
+        async for msg in drain.messages(q):
+            await _handle_one(rmq, msg, redis_url, ws_manager, status_waiters)
+
+
+async def _consume_batches(
+    rmq: MessageTransport,
+    queue,
+    redis_url: str,
+    ws_manager: WebSocketManager | None,
+    status_waiters: StatusWaiters | None,
+) -> None:
+    buffer: asyncio.Queue = asyncio.Queue()
+    tag = await queue.consume(buffer.put)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            ok, first = await drain.get(buffer)
+            if not ok:
+                break
+            batch = [first]
+            deadline = loop.time() + settings.payment_result_batch_wait
+            while len(batch) < settings.payment_result_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(buffer.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
             try:
-                await _handle_payment_result(msg=msg, redis_url=redis_url)
-                await msg.ack()
+                await _handle_payment_results(
+                    messages=batch, redis_url=redis_url, ws_manager=ws_manager, status_waiters=status_waiters
+                )
             except Exception:
-                await msg.nack(requeue=True)
+                # Replay one by one so a single bad message is retried or
+                # dead-lettered without holding back the rest of the batch.
+                for msg in batch:
+                    await _handle_one(rmq, msg, redis_url, ws_manager, status_waiters)
+                continue
 
+            for msg in batch:
+                await msg.ack()
+    finally:
+        await queue.cancel(tag)
+        # Hand prefetched deliveries back to the broker right away instead of
+        # leaving them unacked until the channel closes.
+        while not buffer.empty():
+            with suppress(Exception):
+                await buffer.get_nowait().nack(requeue=True)
 
-async def _handle_payment_result(*, msg, redis_url: str) -> None:
-    message_id = msg.message_id or ""
-    envelope = _parse_message(msg.body)
 
-    payload = envelope.get("payload", {})
-    order_id = payload.get("order_id")
-    payment_status = payload.get("payment_status")
-    if not order_id or payment_status not in ("succeeded", "failed"):
-        return
+async def _handle_one(
+    rmq: MessageTransport,
+    msg,
+    redis_url: str,
+    ws_manager: WebSocketManager | None,
+    status_waiters: StatusWaiters | None,
+) -> None:
+    try:
+        await _handle_payment_results(
+            messages=[msg], redis_url=redis_url, ws_manager=ws_manager, status_waiters=status_waiters
+        )
+        await msg.ack()
+    except Exception as e:
+        try:
+            await rmq.retry_or_dead_letter(msg, queue_name=QUEUE_ORDERS_PAYMENT_RESULTS, error=e)
+        except Exception:
+            await msg.nack(requeue=True)
+
 
-    new_status = OrderStatus.FINISHED if payment_status == "succeeded" else OrderStatus.CANCELLED
+async def _handle_payment_results(
+    *,
+    messages: list,
+    redis_url: str,
+    ws_manager: WebSocketManager | None = None,
+    status_waiters: StatusWaiters | None = None,
+) -> None:
+    results: dict[str, dict[str, Any]] = {}
+    for msg in messages:
+        result = _parse_payment_result(msg)
+        if result is not None:
+            results.setdefault(result["message_id"], result)
+    if not results:
+        return
 
     async with SessionLocal() as session:
         async with session.begin():
-            stmt = insert(InboxMessage).values(message_id=message_id).on_conflict_do_nothing(
-                index_elements=[InboxMessage.message_id]
+            updated = await apply_payment_results(
+                session,
+                results=[(r["message_id"], r["order_id"], r["user_id"], r["status"]) for r in results.values()],
             )
-            res = await session.execute(stmt)
-            inserted = (res.rowcount or 0) > 0
-
-            if inserted:
-                await update_order_status(session, order_id=order_id, new_status=new_status)
-
-        await publish_order_status(redis_url, {
-            "type": "update",
-            "order_id": order_id,
-            "status": new_status.value,
-            "payment_status": payment_status,
-            "reason": payload.get("reason"),
-        })
+
+    # Transitions made here are announced, and so are redeliveries of results
+    # that were already applied: an earlier attempt may have committed and then
+    # failed to publish. Late, conflicting results for terminal orders are not.
+    announced = {
+        r["order_id"]: r for r in results.values() if updated.get(r["order_id"]) == r["status"]
+    }.values()
+    if not announced:
+        return
+
+    async def deliver_local(sequenced: list[dict[str, Any]]) -> None:
+        for message in sequenced:
+            order_id = message["order_id"]
+            if status_waiters is not None:
+                status_waiters.notify(order_id)
+            if ws_manager is not None and ws_manager.has_subscribers(order_id):
+                await ws_manager.broadcast(order_id, message)
+
+    await publish_order_statuses(
+        redis_url,
+        [
+            ({
+                "type": "update",
+                "order_id": r["order_id"],
+                "status": r["status"].value,
+                "payment_status": r["payment_status"],
+                "reason": r["reason"],
+            }, r["user_id"])
+            for r in announced
+        ],
+        deliver_local=deliver_local if ws_manager is not None or status_waiters is not None else None,
+    )
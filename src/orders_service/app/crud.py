@@ -1,11 +1,35 @@
 import uuid
 from datetime import datetime, timezone
 from decimal import Decimal
+from typing import Any
 
-from sqlalchemy import select
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .models import Order, OrderStatus, OutboxEvent
+from .codec import encode
+from .config import settings
+from .messaging import RK_PAYMENT_REQUESTED, payment_request_routing_key, payment_request_shard
+from .models import Order, OrderStats, OrderStatus, OutboxEvent
+
+
+_orders = Order.__table__
+
+ORDER_READ_COLUMNS = (
+    _orders.c.id,
+    _orders.c.user_id,
+    _orders.c.amount,
+    _orders.c.description,
+    _orders.c.status,
+    _orders.c.created_at,
+    _orders.c.updated_at,
+)
+
+
+def _payment_requested_routing_key(user_id: str) -> str:
+    if settings.payment_request_shards <= 0:
+        return RK_PAYMENT_REQUESTED
+    return payment_request_routing_key(payment_request_shard(user_id, settings.payment_request_shards))
 
 
 def _utc_now_iso() -> str:
@@ -23,12 +47,32 @@ async def create_order_with_outbox(
     order = Order(
         user_id=user_id,
         amount=str(amount),
+        amount_value=amount,
         description=description,
         status=OrderStatus.NEW,
     )
     session.add(order)
     await session.flush()
+    await _apply_stats_delta(session, user_id=user_id, deltas=[(OrderStatus.NEW, 1, amount)])
+
+    session.add(payment_requested_outbox(
+        order_id=str(order.id),
+        user_id=user_id,
+        amount=amount,
+        description=description,
+        producer=producer,
+    ))
+    return order
 
+
+def payment_requested_outbox(
+    *,
+    order_id: str,
+    user_id: str,
+    amount: Decimal,
+    description: str,
+    producer: str,
+) -> OutboxEvent:
     event_id = uuid.uuid4()
     envelope = {
         "event_id": str(event_id),
@@ -36,22 +80,23 @@ async def create_order_with_outbox(
         "producer": producer,
         "occurred_at": _utc_now_iso(),
         "payload": {
-            "order_id": str(order.id),
+            "order_id": order_id,
             "user_id": user_id,
             "amount": str(amount),
             "description": description,
         },
     }
 
-    outbox = OutboxEvent(
+    return OutboxEvent(
         id=event_id,
         event_type="PaymentRequested",
         aggregate_type="Order",
-        aggregate_id=str(order.id),
-        payload=envelope,
+        aggregate_id=order_id,
+        routing_key=_payment_requested_routing_key(user_id),
+        body=encode(envelope, settings.message_content_type),
+        content_type=settings.message_content_type,
+        payload=envelope if settings.outbox_store_debug_payload else None,
     )
-    session.add(outbox)
-    return order
 
 
 async def list_orders(session: AsyncSession, *, user_id: str) -> list[Order]:
@@ -68,10 +113,135 @@ async def get_order(session: AsyncSession, *, user_id: str, order_id: str) -> Or
     return res.scalar_one_or_none()
 
 
-async def update_order_status(session: AsyncSession, *, order_id: str, new_status: OrderStatus) -> None:
-    order = await session.get(Order, order_id)
-    if not order:
-        return
-    if order.status in (OrderStatus.FINISHED, OrderStatus.CANCELLED):
-        return
-    order.status = new_status
+async def list_order_rows(session: AsyncSession, *, user_id: str) -> list[dict[str, Any]]:
+    res = await session.execute(
+        select(*ORDER_READ_COLUMNS)
+        .where(_orders.c.user_id == user_id)
+        .order_by(_orders.c.created_at.desc())
+    )
+    return [dict(row) for row in res.mappings()]
+
+
+async def get_order_row(session: AsyncSession, *, user_id: str, order_id: str) -> dict[str, Any] | None:
+    res = await session.execute(
+        select(*ORDER_READ_COLUMNS).where(_orders.c.id == order_id, _orders.c.user_id == user_id)
+    )
+    row = res.mappings().one_or_none()
+    return dict(row) if row is not None else None
+
+
+async def get_order_statuses(
+    session: AsyncSession, *, user_id: str, order_ids: list[uuid.UUID]
+) -> list[dict[str, Any]]:
+    res = await session.execute(
+        select(_orders.c.id, _orders.c.status, _orders.c.updated_at)
+        .where(_orders.c.id.in_(order_ids), _orders.c.user_id == user_id)
+    )
+    return [dict(row) for row in res.mappings()]
+
+
+async def _apply_stats_delta(
+    session: AsyncSession,
+    *,
+    user_id: str,
+    deltas: list[tuple[OrderStatus, int, Decimal]],
+) -> None:
+    stmt = insert(OrderStats).values([
+        {"user_id": user_id, "status": status, "order_count": count, "total_amount": amount}
+        for status, count, amount in deltas
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OrderStats.user_id, OrderStats.status],
+        set_={
+            "order_count": OrderStats.order_count + stmt.excluded.order_count,
+            "total_amount": OrderStats.total_amount + stmt.excluded.total_amount,
+            "updated_at": func.now(),
+        },
+    )
+    await session.execute(stmt)
+
+
+async def get_order_stats(session: AsyncSession, *, user_id: str) -> list[dict[str, Any]]:
+    res = await session.execute(
+        select(OrderStats.status, OrderStats.order_count, OrderStats.total_amount)
+        .where(OrderStats.user_id == user_id)
+    )
+    rows = {row.status: row for row in res}
+    return [
+        {
+            "status": status,
+            "count": rows[status].order_count if status in rows else 0,
+            "total_amount": f"{rows[status].total_amount if status in rows else Decimal(0):.2f}",
+        }
+        for status in OrderStatus
+    ]
+
+
+APPLY_PAYMENT_RESULTS_SQL = text("""
+WITH input AS (
+    SELECT *
+    FROM unnest(
+        CAST(:message_ids AS varchar[]),
+        CAST(:order_ids AS uuid[]),
+        CAST(:user_ids AS varchar[]),
+        CAST(:statuses AS orderstatus[])
+    ) AS t(message_id, order_id, user_id, status)
+),
+inbox AS (
+    INSERT INTO inbox_messages (message_id)
+    SELECT message_id FROM input
+    ON CONFLICT (message_id) DO NOTHING
+    RETURNING message_id
+),
+updated AS (
+    UPDATE orders o
+    SET status = i.status, updated_at = now()
+    FROM input i
+    JOIN inbox ON inbox.message_id = i.message_id
+    WHERE o.id = i.order_id AND o.user_id = i.user_id AND o.status = 'NEW'
+    RETURNING o.id, o.user_id, o.status, COALESCE(o.amount_value, CAST(o.amount AS numeric)) AS amount
+),
+deltas AS (
+    SELECT user_id, CAST('NEW' AS orderstatus) AS status, -count(*) AS order_count, -sum(amount) AS total_amount
+    FROM updated GROUP BY user_id
+    UNION ALL
+    SELECT user_id, status, count(*), sum(amount)
+    FROM updated GROUP BY user_id, status
+),
+stats AS (
+    INSERT INTO order_stats (user_id, status, order_count, total_amount, updated_at)
+    SELECT user_id, status, sum(order_count), sum(total_amount), now()
+    FROM deltas GROUP BY user_id, status
+    ON CONFLICT (user_id, status) DO UPDATE SET
+        order_count = order_stats.order_count + EXCLUDED.order_count,
+        total_amount = order_stats.total_amount + EXCLUDED.total_amount,
+        updated_at = now()
+),
+replayed AS (
+    SELECT o.id, o.status
+    FROM input i
+    JOIN orders o ON o.id = i.order_id AND o.user_id = i.user_id
+    WHERE o.status = i.status
+      AND NOT EXISTS (SELECT 1 FROM inbox WHERE inbox.message_id = i.message_id)
+)
+SELECT id, status FROM updated
+UNION ALL
+SELECT id, status FROM replayed
+""")
+
+
+async def apply_payment_results(
+    session: AsyncSession,
+    *,
+    results: list[tuple[str, str, str, OrderStatus]],
+) -> dict[str, OrderStatus]:
+    res = await session.execute(
+        APPLY_PAYMENT_RESULTS_SQL,
+        {
+            "message_ids": [message_id for message_id, _, _, _ in results],
+            "order_ids": [order_id for _, order_id, _, _ in results],
+            "user_ids": [user_id for _, _, user_id, _ in results],
+            "statuses": [status.value for _, _, _, status in results],
+        },
+    )
+    return {str(order_id): OrderStatus(status) for order_id, status in res.all()}
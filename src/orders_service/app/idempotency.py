@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .codec import encode
+from .config import settings
+from .db import SessionLocal
+from .models import IdempotencyKey
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def request_fingerprint(body: dict[str, Any]) -> str:
+    return hashlib.sha256(encode(body)).hexdigest()
+
+
+async def get_idempotency_record(session: AsyncSession, *, user_id: str, key: str) -> IdempotencyKey | None:
+    res = await session.execute(
+        select(IdempotencyKey).where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at > _utc_now(),
+        )
+    )
+    return res.scalar_one_or_none()
+
+
+async def claim_idempotency_key(session: AsyncSession, *, user_id: str, key: str, request_hash: str) -> bool:
+    now = _utc_now()
+    values = {
+        "user_id": user_id,
+        "key": key,
+        "request_hash": request_hash,
+        "status_code": None,
+        "response_body": None,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=settings.idempotency_key_ttl),
+    }
+    stmt = insert(IdempotencyKey).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.user_id, IdempotencyKey.key],
+        set_={k: stmt.excluded[k] for k in values if k not in ("user_id", "key")},
+        where=IdempotencyKey.expires_at <= now,
+    ).returning(IdempotencyKey.key)
+    res = await session.execute(stmt)
+    return res.first() is not None
+
+
+async def store_idempotent_response(
+    session: AsyncSession, *, user_id: str, key: str, status_code: int, body: bytes
+) -> None:
+    await session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+        .values(status_code=status_code, response_body=body)
+    )
+
+
+async def idempotency_key_reaper() -> None:
+    while True:
+        try:
+            async with SessionLocal() as session:
+                async with session.begin():
+                    await session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= _utc_now()))
+        except Exception:
+            pass
+
+        await asyncio.sleep(settings.idempotency_reap_interval)
@@ -1,23 +1,84 @@
 import asyncio
-from contextlib import asynccontextmanager
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, suppress
 from decimal import Decimal
 
-from fastapi import Depends, FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from .admission import AdmissionController, AdmissionRejected, retry_after_header
+from .codec import encode, encode_text
 from .config import settings
-from .crud import create_order_with_outbox, get_order, list_orders
-from .db import get_session, init_db
-from .messaging import RabbitMQ
-from .outbox import outbox_dispatcher
-from .consumer import payment_result_consumer
-from .redis_pubsub import redis_listener
-from .schemas import CreateOrderRequest, OrderListResponse, OrderResponse
-from .websocket_manager import WebSocketManager
+from .crud import create_order_with_outbox, get_order_row, get_order_stats, get_order_statuses, list_order_rows
+from .db import (
+    SessionLocal,
+    check_db,
+    get_read_session,
+    get_session,
+    init_db,
+    mark_write,
+    replica_engine,
+    replica_lag_monitor,
+)
+from .drain import drain
+from .health import HealthChecker
+from .loop_monitor import loop_monitor, sample_profile
+from .idempotency import (
+    claim_idempotency_key,
+    get_idempotency_record,
+    request_fingerprint,
+    store_idempotent_response,
+)
+from .messaging import QUEUE_ORDERS_PAYMENT_RESULTS, dead_letter_queue_name
+from .models import OrderStatus
+from .redis_pubsub import ping_redis, read_order_status_log, redis_listener, wait_for_redis
+from .outbox import count_abandoned, list_abandoned, rearm_abandoned
+from .schemas import (
+    AbandonedOutboxListResponse,
+    AbandonedOutboxRearmResponse,
+    CreateOrderRequest,
+    DeadLetterListResponse,
+    DeadLetterReplayResponse,
+    OrderListResponse,
+    OrderResponse,
+    OrderStatsResponse,
+    OrderStatusBatchRequest,
+    OrderStatusBatchResponse,
+)
+from .status_waiters import StatusWaiters
+from .websocket_manager import (
+    TERMINAL_STATUSES,
+    WS_CLOSE_NORMAL,
+    WebSocketManager,
+)
+from .worker import create_rmq, start_background_tasks
 
 
-ws_manager = WebSocketManager()
-rmq = RabbitMQ(settings.rabbitmq_url)
+logger = logging.getLogger(__name__)
+
+ws_manager = WebSocketManager(
+    max_connections=settings.ws_max_connections,
+    max_per_user=settings.ws_max_per_user,
+    send_timeout=settings.ws_send_timeout,
+)
+status_waiters = StatusWaiters()
+rmq = create_rmq()
+profile_lock = asyncio.Lock()
+admission = AdmissionController(settings.redis_url, rmq)
+readiness = HealthChecker(
+    {
+        "postgres": check_db,
+        "rabbitmq": rmq.check,
+        "redis": lambda: ping_redis(settings.redis_url),
+    },
+    ttl=settings.readiness_cache_ttl,
+    timeout=settings.readiness_check_timeout,
+)
 
 
 async def _require_user_id(x_user_id: str | None = Header(default=None, alias="X-User-Id")) -> str:
@@ -26,21 +87,59 @@ async def _require_user_id(x_user_id: str | None = Header(default=None, alias="X
     return x_user_id
 
 
+def _etag(*parts: object) -> str:
+    digest = hashlib.blake2b("|".join(map(str, parts)).encode("utf-8"), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in if_none_match.split(","))
+
+
+async def _admit_order(user_id: str) -> None:
+    try:
+        await admission.admit(user_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.reason,
+            headers={"Retry-After": retry_after_header(e.retry_after)},
+        )
+
+
+async def _require_admin(x_admin_token: str | None = Header(default=None, alias="X-Admin-Token")) -> None:
+    if not settings.admin_token or x_admin_token != settings.admin_token:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
-    await rmq.connect()
+    started = time.perf_counter()
+    migrated, _, _ = await asyncio.gather(init_db(), rmq.connect(), wait_for_redis(settings.redis_url))
+    app.state.startup_seconds = time.perf_counter() - started
+    logger.info("startup completed in %.3fs (schema migrated: %s)", app.state.startup_seconds, migrated)
 
     tasks: list[asyncio.Task] = []
-    tasks.append(asyncio.create_task(outbox_dispatcher(rmq)))
-    tasks.append(asyncio.create_task(payment_result_consumer(rmq, settings.redis_url)))
-    tasks.append(asyncio.create_task(redis_listener(settings.redis_url, ws_manager)))
+    if settings.run_background_workers:
+        tasks.extend(start_background_tasks(rmq, ws_manager, status_waiters))
+    if replica_engine is not None:
+        tasks.append(asyncio.create_task(replica_lag_monitor()))
+    if settings.loop_monitor_enabled:
+        tasks.append(asyncio.create_task(loop_monitor.run()))
+    tasks.append(asyncio.create_task(redis_listener(settings.redis_url, ws_manager, status_waiters)))
+    tasks.append(asyncio.create_task(admission.sampler()))
 
     try:
         yield
     finally:
+        await drain.drain(settings.shutdown_drain_timeout)
         for t in tasks:
             t.cancel()
+        await admission.close()
         await rmq.close()
 
 
@@ -48,6 +147,7 @@ app = FastAPI(
     title="Orders Service",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/orders/docs",
     openapi_url="/orders/openapi.json",
 )
@@ -58,73 +158,307 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+async def ready():
+    ok, checks = await readiness.ready()
+    return ORJSONResponse(
+        {
+            "status": "ready" if ok else "unavailable",
+            "startup_seconds": round(app.state.startup_seconds, 3),
+            "checks": checks,
+        },
+        status_code=200 if ok else 503,
+    )
+
+
+@app.get("/admin/dead-letters", response_model=DeadLetterListResponse, dependencies=[Depends(_require_admin)])
+async def admin_list_dead_letters(limit: int = Query(100, ge=1, le=1000)):
+    messages = await rmq.list_dead_letters(QUEUE_ORDERS_PAYMENT_RESULTS, limit=limit)
+    return {"queue": dead_letter_queue_name(QUEUE_ORDERS_PAYMENT_RESULTS), "messages": messages}
+
+
+@app.post("/admin/dead-letters/replay", response_model=DeadLetterReplayResponse, dependencies=[Depends(_require_admin)])
+async def admin_replay_dead_letters(limit: int = Query(100, ge=1, le=1000)):
+    replayed = await rmq.replay_dead_letters(QUEUE_ORDERS_PAYMENT_RESULTS, limit=limit)
+    return {"queue": dead_letter_queue_name(QUEUE_ORDERS_PAYMENT_RESULTS), "replayed": replayed}
+
+
+@app.get("/admin/outbox/abandoned", response_model=AbandonedOutboxListResponse, dependencies=[Depends(_require_admin)])
+async def admin_list_abandoned_outbox(
+    limit: int = Query(100, ge=1, le=1000),
+    session: AsyncSession = Depends(get_session),
+):
+    return {"events": await list_abandoned(session, limit=limit)}
+
+
+@app.post(
+    "/admin/outbox/abandoned/rearm",
+    response_model=AbandonedOutboxRearmResponse,
+    dependencies=[Depends(_require_admin)],
+)
+async def admin_rearm_abandoned_outbox(
+    limit: int = Query(100, ge=1, le=1000),
+    session: AsyncSession = Depends(get_session),
+):
+    async with session.begin():
+        rearmed = await rearm_abandoned(session, limit=limit)
+    return {"rearmed": rearmed}
+
+
+async def _outbox_gauges() -> str:
+    try:
+        async with SessionLocal() as session:
+            abandoned = await count_abandoned(session)
+    except Exception:
+        return ""
+    name = f"{settings.service_name}_outbox_abandoned_events"
+    return f"# TYPE {name} gauge\n{name} {abandoned}\n"
+
+
+@app.get("/metrics")
+async def metrics():
+    gauges = "".join(
+        f"# TYPE {settings.service_name}_websocket_{name} gauge\n{settings.service_name}_websocket_{name} {value}\n"
+        for name, value in ws_manager.stats().items()
+    ) + await _outbox_gauges()
+    return PlainTextResponse(
+        loop_monitor.histogram.prometheus(f"{settings.service_name}_event_loop_lag_seconds") + gauges,
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.get("/admin/loop-lag", dependencies=[Depends(_require_admin)])
+async def admin_loop_lag():
+    return loop_monitor.histogram.snapshot()
+
+
+@app.post("/admin/profile", dependencies=[Depends(_require_admin)])
+async def admin_profile(
+    seconds: float = Query(5.0, gt=0, le=settings.profile_max_seconds),
+    all_threads: bool = Query(False),
+):
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    async with profile_lock:
+        collapsed = await sample_profile(
+            None if all_threads else threading.get_ident(),
+            duration=seconds,
+            interval=settings.profile_sample_interval,
+        )
+    filename = f"{settings.service_name}-{os.getpid()}-{int(time.time())}.collapsed"
+    return PlainTextResponse(collapsed, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 @app.post("/orders", response_model=OrderResponse, status_code=status.HTTP_201_CREATED)
 async def create_order(
     body: CreateOrderRequest,
+    response: Response,
     user_id: str = Depends(_require_user_id),
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key", max_length=128),
     session: AsyncSession = Depends(get_session),
 ):
     amount = Decimal(body.amount)
 
+    if not idempotency_key:
+        await _admit_order(user_id)
+        async with session.begin():
+            order = await create_order_with_outbox(
+                session,
+                user_id=user_id,
+                amount=amount,
+                description=body.description,
+                producer=settings.service_name,
+            )
+        mark_write(response)
+        return order
+
+    request_hash = request_fingerprint(body.model_dump(mode="json"))
+
+    # Replays are answered before admission so client retries neither get
+    # 429 nor spend tokens.
     async with session.begin():
-        order = await create_order_with_outbox(
-            session,
-            user_id=user_id,
-            amount=amount,
-            description=body.description,
-            producer=settings.service_name,
-        )
+        record = await get_idempotency_record(session, user_id=user_id, key=idempotency_key)
+
+    if record is None:
+        await _admit_order(user_id)
+        async with session.begin():
+            if await claim_idempotency_key(session, user_id=user_id, key=idempotency_key, request_hash=request_hash):
+                order = await create_order_with_outbox(
+                    session,
+                    user_id=user_id,
+                    amount=amount,
+                    description=body.description,
+                    producer=settings.service_name,
+                )
+                content = encode(OrderResponse.model_validate(order).model_dump(mode="json"))
+                await store_idempotent_response(
+                    session,
+                    user_id=user_id,
+                    key=idempotency_key,
+                    status_code=status.HTTP_201_CREATED,
+                    body=content,
+                )
+                created = Response(content, status_code=status.HTTP_201_CREATED, media_type="application/json")
+                mark_write(created)
+                return created
+
+            record = await get_idempotency_record(session, user_id=user_id, key=idempotency_key)
 
-    return order
+    if record is None or record.response_body is None:
+        raise HTTPException(status_code=409, detail="Request with this Idempotency-Key is still in progress")
+    if record.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    return Response(
+        record.response_body,
+        status_code=record.status_code,
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"},
+    )
 
 
 @app.get("/orders", response_model=OrderListResponse)
 async def get_orders(
     user_id: str = Depends(_require_user_id),
-    session: AsyncSession = Depends(get_session),
+    if_none_match: str | None = Header(default=None),
+    session: AsyncSession = Depends(get_read_session),
+):
+    orders = await list_order_rows(session, user_id=user_id)
+    etag = _etag(len(orders), max((o["updated_at"] for o in orders), default=""))
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return ORJSONResponse({"orders": orders}, headers={"ETag": etag})
+
+
+@app.get("/orders/stats", response_model=OrderStatsResponse)
+async def get_orders_stats(
+    user_id: str = Depends(_require_user_id),
+    session: AsyncSession = Depends(get_read_session),
+):
+    stats = await get_order_stats(session, user_id=user_id)
+    return {"user_id": user_id, "stats": stats}
+
+
+@app.post("/orders/statuses", response_model=OrderStatusBatchResponse)
+async def get_orders_statuses(
+    body: OrderStatusBatchRequest,
+    user_id: str = Depends(_require_user_id),
+    session: AsyncSession = Depends(get_read_session),
 ):
-    orders = await list_orders(session, user_id=user_id)
-    return {"orders": orders}
+    statuses = await get_order_statuses(session, user_id=user_id, order_ids=body.order_ids)
+    return ORJSONResponse({"statuses": statuses})
 
 
 @app.get("/orders/{order_id}", response_model=OrderResponse)
 async def get_order_status(
     order_id: str,
+    wait: float = Query(0, ge=0),
     user_id: str = Depends(_require_user_id),
-    session: AsyncSession = Depends(get_session),
+    if_none_match: str | None = Header(default=None),
+    session: AsyncSession = Depends(get_read_session),
 ):
-    order = await get_order(session, user_id=user_id, order_id=order_id)
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    return order
+    with status_waiters.watch(order_id) as changed:
+        if wait > 0:
+            # The pre-wait read decides whether to wait at all; a lagging
+            # replica would park the request on a change that already happened.
+            async with SessionLocal() as primary:
+                order = await get_order_row(primary, user_id=user_id, order_id=order_id)
+        else:
+            order = await get_order_row(session, user_id=user_id, order_id=order_id)
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        etag = _etag(order["id"], order["updated_at"].isoformat())
+
+        if wait > 0 and order["status"] == OrderStatus.NEW:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(changed.wait(), timeout=min(wait, settings.long_poll_max_wait))
+                async with SessionLocal() as primary:
+                    order = await get_order_row(primary, user_id=user_id, order_id=order_id) or order
+                etag = _etag(order["id"], order["updated_at"].isoformat())
+
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return ORJSONResponse(order, headers={"ETag": etag})
+
+
+def _replayable(log: list[tuple[str, dict]], *, user_id: str, last_seq: int) -> bool:
+    if not log or any(owner != user_id for owner, _ in log):
+        return False
+    return log[0][1]["seq"] <= last_seq + 1
+
+
+async def _owns_order(order_id: str, *, user_id: str) -> bool:
+    log = await read_order_status_log(settings.redis_url, order_id)
+    if log and all(owner == user_id for owner, _ in log):
+        return True
+    async with SessionLocal() as session:
+        return await get_order_row(session, user_id=user_id, order_id=order_id) is not None
+
+
+# Liveness is uvicorn's protocol-level ping/pong (--ws-ping-interval and
+# --ws-ping-timeout); the JSON ping is only keep-alive traffic and clients
+# never have to answer it.
+async def _ws_heartbeat(ws: WebSocket) -> None:
+    while ws_manager.is_connected(ws):
+        try:
+            await asyncio.wait_for(ws.receive_text(), settings.ws_ping_interval or None)
+            continue
+        except asyncio.TimeoutError:
+            pass
+        if ws_manager.is_connected(ws) and not await ws_manager.send(ws, encode_text({"type": "ping"})):
+            return
 
 
 @app.websocket("/ws/orders/{order_id}")
-async def ws_order_status(ws: WebSocket, order_id: str, user_id: str | None = None):
+async def ws_order_status(ws: WebSocket, order_id: str, user_id: str | None = None, last_seq: int | None = None):
     if not user_id:
         await ws.close(code=1008)
         return
 
-    from .db import SessionLocal
-    async with SessionLocal() as session:
-        order = await get_order(session, user_id=user_id, order_id=order_id)
-        if not order:
-            await ws.close(code=1008)
-            return
+    # Ownership is settled before registering, so broadcasts never reach a
+    # non-owner and rejected sockets take no cap slot.
+    if not await _owns_order(order_id, user_id=user_id):
+        await ws.close(code=1008)
+        return
+
+    if not await ws_manager.connect(order_id, ws, user_id=user_id):
+        return
+    try:
+        log = await read_order_status_log(settings.redis_url, order_id)
 
-    await ws_manager.connect(order_id, ws)
+        if last_seq is not None and _replayable(log, user_id=user_id, last_seq=last_seq):
+            status_value = log[-1][1]["status"]
+            for _, message in log:
+                if message["seq"] > last_seq:
+                    await ws.send_text(encode_text(message))
+        else:
+            # From the primary: the snapshot carries the log's latest seq, so a
+            # lagging replica's status would stick on the client.
+            async with SessionLocal() as session:
+                order = await get_order_row(session, user_id=user_id, order_id=order_id)
+            if not order:
+                await ws.close(code=1008)
+                return
 
-    await ws.send_json({
-        "type": "snapshot",
-        "order_id": order_id,
-        "status": order.status.value,
-        "amount": order.amount,
-    })
+            status_value = order["status"].value
+            await ws.send_text(encode_text({
+                "type": "snapshot",
+                "order_id": order_id,
+                "status": status_value,
+                "amount": order["amount"],
+                "seq": log[-1][1]["seq"] if log else 0,
+            }))
 
-    try:
-        while True:
-            _ = await ws.receive_text()
+        if status_value in TERMINAL_STATUSES:
+            await ws_manager.close(order_id, ws, code=WS_CLOSE_NORMAL, reason="Order completed")
+            return
+
+        await _ws_heartbeat(ws)
     except WebSocketDisconnect:
         pass
+    except RuntimeError:
+        # Starlette raises this for a socket we already closed ourselves;
+        # anything else is a real failure.
+        if ws_manager.is_connected(ws):
+            logger.exception("order %s websocket failed", order_id)
     finally:
         await ws_manager.disconnect(order_id, ws)
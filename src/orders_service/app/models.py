@@ -1,11 +1,15 @@
 import enum
 import uuid
 from datetime import datetime
+from decimal import Decimal
 
-from sqlalchemy import DateTime, Enum, Integer, String, func
+from sqlalchemy import BigInteger, DateTime, Enum, Index, Integer, LargeBinary, Numeric, String, func, text
 from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
+from .config import settings
+from .partitioning import attach_hash_partitions, partition_by_user
+
 
 class Base(DeclarativeBase):
     pass
@@ -17,12 +21,20 @@ class OrderStatus(str, enum.Enum):
     CANCELLED = "CANCELLED"
 
 
+USER_PARTITIONS = settings.user_partitions
+
+
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_new_created", "created_at", "id", postgresql_where=text("status = 'NEW'")),
+        partition_by_user(USER_PARTITIONS),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id: Mapped[str] = mapped_column(String(128), index=True, nullable=False)
+    user_id: Mapped[str] = mapped_column(String(128), primary_key=USER_PARTITIONS > 0, index=True, nullable=False)
     amount: Mapped[str] = mapped_column(String(64), nullable=False)
+    amount_value: Mapped[Decimal | None] = mapped_column(Numeric(18, 2), nullable=True)
     description: Mapped[str] = mapped_column(String(512), nullable=False, default="")
     status: Mapped[OrderStatus] = mapped_column(Enum(OrderStatus), nullable=False, default=OrderStatus.NEW)
 
@@ -30,20 +42,46 @@ class Order(Base):
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
 
+if USER_PARTITIONS:
+    attach_hash_partitions(Order.__table__, USER_PARTITIONS)
+
+
+class OrderStats(Base):
+    __tablename__ = "order_stats"
+
+    user_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    status: Mapped[OrderStatus] = mapped_column(Enum(OrderStatus), primary_key=True)
+    order_count: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    total_amount: Mapped[Decimal] = mapped_column(Numeric(18, 2), nullable=False, default=0)
+
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
 class OutboxEvent(Base):
     __tablename__ = "outbox_events"
+    __table_args__ = (
+        Index(
+            "ix_outbox_events_pending",
+            "created_at",
+            postgresql_where=text("published_at IS NULL"),
+        ),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     event_type: Mapped[str] = mapped_column(String(128), nullable=False)
     aggregate_type: Mapped[str] = mapped_column(String(128), nullable=False)
     aggregate_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    routing_key: Mapped[str | None] = mapped_column(String(256), nullable=True)
 
-    payload: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    body: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    content_type: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    payload: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     published_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
     attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     last_error: Mapped[str | None] = mapped_column(String(1024), nullable=True)
 
 
@@ -52,3 +90,17 @@ class InboxMessage(Base):
 
     message_id: Mapped[str] = mapped_column(String(128), primary_key=True)
     received_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    user_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    request_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+
+    status_code: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    response_body: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True, nullable=False)
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Any
+
+from sqlalchemy import DDL, PrimaryKeyConstraint, Table, UniqueConstraint, event, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+
+logger = logging.getLogger(__name__)
+
+PARTITION_KEY = "user_id"
+SHADOW_SUFFIX = "_partitioned"
+OLD_SUFFIX = "_unpartitioned"
+NEW_NAME_SUFFIX = "__new"
+
+
+def partition_by_user(partitions: int) -> dict[str, Any]:
+    return {"postgresql_partition_by": f"HASH ({PARTITION_KEY})"} if partitions > 0 else {}
+
+
+def partition_names(table: str, partitions: int) -> list[str]:
+    return [f"{table}_p{i}" for i in range(partitions)]
+
+
+def hash_partition_ddl(table: str, parent: str, partitions: int) -> list[str]:
+    return [
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} "
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+        for i, name in enumerate(partition_names(table, partitions))
+    ]
+
+
+def attach_hash_partitions(table: Table, partitions: int) -> None:
+    for ddl in hash_partition_ddl(table.name, table.name, partitions):
+        event.listen(table, "after_create", DDL(ddl))
+
+
+def partitioned_tables(metadata) -> list[Table]:
+    return [
+        t for t in metadata.sorted_tables
+        if t.dialect_options["postgresql"].get("partition_by")
+    ]
+
+
+async def is_partitioned(conn: AsyncConnection, table: str) -> bool:
+    return bool(await conn.scalar(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t))"),
+        {"t": table},
+    ))
+
+
+async def scanned_partitions(conn: AsyncConnection, table: str, stmt, params: dict[str, Any]) -> set[str]:
+    plan = await conn.scalar(text(f"EXPLAIN (FORMAT JSON) {stmt}"), params)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    pattern = re.compile(rf"^{re.escape(table)}_p\d+$")
+    found: set[str] = set()
+
+    def walk(node: dict[str, Any]) -> None:
+        relation = node.get("Relation Name")
+        if relation and pattern.match(relation):
+            found.add(relation)
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return found
+
+
+# Rebuilds a live table as hash-partitioned: a trigger mirrors writes into a
+# shadow table while existing rows are copied in keyset batches, then the names
+# are swapped under a short exclusive lock.
+class OnlinePartitioner:
+    def __init__(self, engine: AsyncEngine, table: Table, partitions: int) -> None:
+        self.engine = engine
+        self.table = table
+        self.partitions = partitions
+        self.name = table.name
+        self.shadow = f"{table.name}{SHADOW_SUFFIX}"
+        self.columns = [c.name for c in table.columns]
+        self.pk = [c.name for c in table.primary_key.columns]
+        if PARTITION_KEY not in self.pk:
+            raise ValueError(f"{self.name}: primary key must include {PARTITION_KEY} to be partitioned")
+        self.cursor_column = next(c for c in self.pk if c != PARTITION_KEY)
+
+    def _named_objects(self) -> list[tuple[str, str]]:
+        objects = []
+        for index in self.table.indexes:
+            unique = "UNIQUE " if index.unique else ""
+            cols = ", ".join(c.name for c in index.columns)
+            where = index.dialect_options["postgresql"].get("where")
+            predicate = f" WHERE {where}" if where is not None else ""
+            objects.append((
+                index.name,
+                f"CREATE {unique}INDEX IF NOT EXISTS {index.name}{NEW_NAME_SUFFIX} ON {self.shadow} ({cols}){predicate}",
+            ))
+        for constraint in self.table.constraints:
+            if isinstance(constraint, UniqueConstraint) and not isinstance(constraint, PrimaryKeyConstraint) and constraint.name:
+                cols = ", ".join(c.name for c in constraint.columns)
+                objects.append((
+                    constraint.name,
+                    f"ALTER TABLE {self.shadow} ADD CONSTRAINT {constraint.name}{NEW_NAME_SUFFIX} UNIQUE ({cols})",
+                ))
+        return objects
+
+    async def prepare(self) -> None:
+        cols = ", ".join(self.columns)
+        pk = ", ".join(self.pk)
+        updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in self.columns if c not in self.pk)
+        conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        match_old = " AND ".join(f"{c} = OLD.{c}" for c in self.pk)
+        key_changed = " OR ".join(f"OLD.{c} IS DISTINCT FROM NEW.{c}" for c in self.pk)
+
+        async with self.engine.begin() as conn:
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {self.shadow} (LIKE {self.name} INCLUDING DEFAULTS) "
+                f"PARTITION BY HASH ({PARTITION_KEY})"
+            ))
+            if not await conn.scalar(text(
+                "SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(:t) AND contype = 'p')"
+            ), {"t": self.shadow}):
+                await conn.execute(text(f"ALTER TABLE {self.shadow} ADD PRIMARY KEY ({pk})"))
+            for ddl in hash_partition_ddl(self.name, self.shadow, self.partitions):
+                await conn.execute(text(ddl))
+            for name, ddl in self._named_objects():
+                exists = await conn.scalar(text("SELECT to_regclass(:n) IS NOT NULL"), {"n": f"{name}{NEW_NAME_SUFFIX}"})
+                if not exists:
+                    await conn.execute(text(ddl))
+
+            await conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION {self.name}_partition_sync() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND ({key_changed})) THEN
+                        DELETE FROM {self.shadow} WHERE {match_old};
+                    END IF;
+                    IF TG_OP <> 'DELETE' THEN
+                        INSERT INTO {self.shadow} ({cols}) SELECT {cols} FROM (SELECT NEW.*) AS n
+                        ON CONFLICT ({pk}) {conflict};
+                    END IF;
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql
+            """))
+            await conn.execute(text(f"DROP TRIGGER IF EXISTS {self.name}_partition_sync ON {self.name}"))
+            await conn.execute(text(
+                f"CREATE TRIGGER {self.name}_partition_sync AFTER INSERT OR UPDATE OR DELETE ON {self.name} "
+                f"FOR EACH ROW EXECUTE FUNCTION {self.name}_partition_sync()"
+            ))
+
+    async def backfill(self, *, batch_size: int, pause: float) -> int:
+        cols = ", ".join(self.columns)
+        pk = ", ".join(self.pk)
+        cursor = self.cursor_column
+        copied = 0
+        last = None
+
+        while True:
+            where = f"WHERE {cursor} > :last" if last is not None else ""
+            params = {"limit": batch_size} if last is None else {"limit": batch_size, "last": last}
+            async with self.engine.begin() as conn:
+                row = (await conn.execute(text(f"""
+                    WITH batch AS (
+                        SELECT {cols} FROM {self.name} {where} ORDER BY {cursor} LIMIT :limit
+                    ),
+                    copied AS (
+                        INSERT INTO {self.shadow} ({cols}) SELECT {cols} FROM batch
+                        ON CONFLICT ({pk}) DO NOTHING
+                    )
+                    SELECT (SELECT count(*) FROM batch), (SELECT {cursor} FROM batch ORDER BY {cursor} DESC LIMIT 1)
+                """), params)).one()
+            count, last = row
+            if not count:
+                return copied
+            copied += count
+            logger.info("%s: copied %d rows (last %s=%s)", self.name, copied, cursor, last)
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+    async def swap(self, *, drop_old: bool, lock_timeout: float, attempts: int = 10) -> None:
+        for attempt in range(1, attempts + 1):
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(text(f"SET LOCAL lock_timeout = '{int(lock_timeout * 1000)}ms'"))
+                    await conn.execute(text(f"LOCK TABLE {self.name} IN ACCESS EXCLUSIVE MODE"))
+                    await conn.execute(text(f"DROP TRIGGER IF EXISTS {self.name}_partition_sync ON {self.name}"))
+                    await conn.execute(text(f"DROP FUNCTION IF EXISTS {self.name}_partition_sync()"))
+
+                    old = f"{self.name}{OLD_SUFFIX}"
+                    await conn.execute(text(f"ALTER TABLE {self.name} RENAME TO {old}"))
+                    await conn.execute(text(f"ALTER TABLE {old} RENAME CONSTRAINT {self.name}_pkey TO {old}_pkey"))
+                    for name, _ in self._named_objects():
+                        await conn.execute(text(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}{OLD_SUFFIX}"))
+                        await conn.execute(text(f"ALTER INDEX IF EXISTS {name}{NEW_NAME_SUFFIX} RENAME TO {name}"))
+
+                    await conn.execute(text(f"ALTER TABLE {self.shadow} RENAME TO {self.name}"))
+                    await conn.execute(text(f"ALTER TABLE {self.name} RENAME CONSTRAINT {self.shadow}_pkey TO {self.name}_pkey"))
+                    if drop_old:
+                        await conn.execute(text(f"DROP TABLE {old}"))
+                return
+            except Exception as e:
+                if attempt == attempts:
+                    raise
+                logger.warning("%s: swap attempt %d failed (%s), retrying", self.name, attempt, e)
+                await asyncio.sleep(min(5.0, 0.5 * attempt))
+
+    async def run(self, *, batch_size: int, pause: float, drop_old: bool, lock_timeout: float) -> None:
+        async with self.engine.connect() as conn:
+            if await is_partitioned(conn, self.name):
+                logger.info("%s: already partitioned", self.name)
+                return
+        await self.prepare()
+        copied = await self.backfill(batch_size=batch_size, pause=pause)
+        await self.swap(drop_old=drop_old, lock_timeout=lock_timeout)
+        logger.info("%s: partitioned into %d partitions (%d rows backfilled)", self.name, self.partitions, copied)
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import select, text, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from .config import settings
+from .crud import apply_payment_results, payment_requested_outbox
+from .db import SessionLocal, engine
+from .models import Order, OrderStatus, OutboxEvent
+from .redis_pubsub import publish_order_statuses
+
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_LOCK_KEY = 4_240_002
+
+PAYMENT_STATUS_TO_ORDER = {
+    "succeeded": OrderStatus.FINISHED,
+    "failed": OrderStatus.CANCELLED,
+}
+
+PAYMENTS_FOR_ORDERS_SQL = text(
+    "SELECT order_id, status, reason FROM payments WHERE order_id = ANY(CAST(:order_ids AS varchar[]))"
+)
+
+_orders = Order.__table__
+
+
+async def _stale_orders(*, cutoff: datetime, after: tuple | None, limit: int) -> list:
+    stmt = (
+        select(
+            _orders.c.id,
+            _orders.c.user_id,
+            _orders.c.amount,
+            _orders.c.amount_value,
+            _orders.c.description,
+            _orders.c.created_at,
+        )
+        .where(_orders.c.status == OrderStatus.NEW, _orders.c.created_at < cutoff)
+        .order_by(_orders.c.created_at, _orders.c.id)
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(_orders.c.created_at, _orders.c.id) > tuple_(*after))
+    async with SessionLocal() as session:
+        return (await session.execute(stmt)).all()
+
+
+async def _payments_for(payments_engine: AsyncEngine, order_ids: list[str]) -> dict[str, tuple[str, str | None]]:
+    async with payments_engine.connect() as conn:
+        res = await conn.execute(PAYMENTS_FOR_ORDERS_SQL, {"order_ids": order_ids})
+        return {order_id: (status, reason) for order_id, status, reason in res.all()}
+
+
+async def _settle(settled: list[tuple], redis_url: str) -> int:
+    async with SessionLocal() as session:
+        async with session.begin():
+            updated = await apply_payment_results(
+                session,
+                results=[
+                    (f"reconcile:{row.id}", str(row.id), row.user_id, PAYMENT_STATUS_TO_ORDER[status])
+                    for row, status, _ in settled
+                ],
+            )
+
+    announced = [(row, status, reason) for row, status, reason in settled if str(row.id) in updated]
+    if announced:
+        await publish_order_statuses(redis_url, [
+            ({
+                "type": "update",
+                "order_id": str(row.id),
+                "status": PAYMENT_STATUS_TO_ORDER[status].value,
+                "payment_status": status,
+                "reason": reason,
+            }, row.user_id)
+            for row, status, reason in announced
+        ])
+    return len(announced)
+
+
+# An order without a payments row may still have its PaymentRequested waiting
+# in the outbox (e.g. during a broker outage); writing another would only
+# grow the backlog. Abandoned events are re-armed instead of duplicated.
+async def _request_payments(missing: list) -> Counter:
+    async with SessionLocal() as session:
+        async with session.begin():
+            res = await session.execute(
+                select(OutboxEvent.id, OutboxEvent.aggregate_id, OutboxEvent.attempts).where(
+                    OutboxEvent.published_at.is_(None),
+                    OutboxEvent.event_type == "PaymentRequested",
+                    OutboxEvent.aggregate_id.in_([str(row.id) for row in missing]),
+                )
+            )
+            unpublished = res.all()
+            pending = {ev.aggregate_id for ev in unpublished if ev.attempts < settings.outbox_max_attempts}
+            abandoned = {
+                ev.aggregate_id: ev.id for ev in unpublished
+                if ev.attempts >= settings.outbox_max_attempts and ev.aggregate_id not in pending
+            }
+
+            if abandoned:
+                await session.execute(
+                    update(OutboxEvent)
+                    .where(OutboxEvent.id.in_(list(abandoned.values())))
+                    .values(attempts=0, next_attempt_at=None)
+                )
+
+            new = [row for row in missing if str(row.id) not in pending and str(row.id) not in abandoned]
+            session.add_all([
+                payment_requested_outbox(
+                    order_id=str(row.id),
+                    user_id=row.user_id,
+                    amount=row.amount_value if row.amount_value is not None else Decimal(row.amount),
+                    description=row.description,
+                    producer=settings.service_name,
+                )
+                for row in new
+            ])
+
+    return Counter(payment_pending=len(pending), payment_rearmed=len(abandoned), payment_requested=len(new))
+
+
+async def reconcile(
+    payments_engine: AsyncEngine,
+    *,
+    older_than: float,
+    chunk_size: int,
+    dry_run: bool = False,
+) -> Counter:
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than)
+    counts: Counter = Counter()
+    started = time.monotonic()
+    after = None
+
+    while True:
+        rows = await _stale_orders(cutoff=cutoff, after=after, limit=chunk_size)
+        if not rows:
+            break
+        after = (rows[-1].created_at, rows[-1].id)
+
+        payments = await _payments_for(payments_engine, [str(row.id) for row in rows])
+        settled, missing = [], []
+        for row in rows:
+            payment = payments.get(str(row.id))
+            if payment is None:
+                missing.append(row)
+            elif payment[0] in PAYMENT_STATUS_TO_ORDER:
+                settled.append((row, *payment))
+            else:
+                counts["unknown_payment_status"] += 1
+
+        counts["scanned"] += len(rows)
+        counts["paid_but_new"] += len(settled)
+        counts["missing_payment"] += len(missing)
+        if not dry_run:
+            if settled:
+                counts["settled"] += await _settle(settled, settings.redis_url)
+            if missing:
+                counts.update(await _request_payments(missing))
+
+        elapsed = time.monotonic() - started
+        logger.info("reconcile progress: %s (%.0f rows/s)", dict(counts), counts["scanned"] / max(elapsed, 1e-9))
+
+    counts["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+    return counts
+
+
+async def reconcile_once(payments_engine: AsyncEngine, **kwargs) -> Counter | None:
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": RECONCILE_LOCK_KEY}):
+            return None
+        try:
+            return await reconcile(payments_engine, **kwargs)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RECONCILE_LOCK_KEY})
+
+
+async def reconcile_loop() -> None:
+    assert settings.payments_database_url is not None
+    payments_engine = create_async_engine(settings.payments_database_url, pool_pre_ping=True, pool_size=2)
+
+    try:
+        while True:
+            await asyncio.sleep(settings.reconcile_interval)
+            try:
+                counts = await reconcile_once(
+                    payments_engine,
+                    older_than=settings.reconcile_older_than,
+                    chunk_size=settings.reconcile_chunk_size,
+                )
+                if counts and (counts["paid_but_new"] or counts["missing_payment"]):
+                    logger.warning("reconcile repaired stale orders: %s", dict(counts))
+            except Exception:
+                logger.exception("reconcile run failed")
+    finally:
+        await payments_engine.dispose()
+
+
+async def run(args: argparse.Namespace) -> None:
+    payments_engine = create_async_engine(args.payments_database_url, pool_pre_ping=True)
+    try:
+        counts = await reconcile_once(
+            payments_engine,
+            older_than=args.older_than,
+            chunk_size=args.chunk_size,
+            dry_run=args.dry_run,
+        )
+    finally:
+        await payments_engine.dispose()
+        await engine.dispose()
+
+    if counts is None:
+        print("another reconcile run is in progress")
+        return
+    rate = counts["scanned"] / max(counts["elapsed_ms"] / 1000, 1e-9)
+    print(" ".join(f"{k}={v}" for k, v in sorted(counts.items())) + f" rows_per_s={rate:.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Repair orders stuck in NEW against payments_db")
+    parser.add_argument("--payments-database-url", default=settings.payments_database_url)
+    parser.add_argument("--older-than", type=float, default=settings.reconcile_older_than, help="Seconds")
+    parser.add_argument("--chunk-size", type=int, default=settings.reconcile_chunk_size)
+    parser.add_argument("--dry-run", action="store_true", help="Only count mismatches")
+    args = parser.parse_args()
+    if not args.payments_database_url:
+        parser.error("--payments-database-url or PAYMENTS_DATABASE_URL is required")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,104 @@
-import json
+import asyncio
+from collections.abc import Awaitable, Callable
 from typing import Any
 
 import redis.asyncio as redis
 
+from .codec import decode, encode
+from .config import settings
+from .status_waiters import StatusWaiters
 from .websocket_manager import WebSocketManager
 
 CHANNEL_ORDER_STATUS = "order_status"
 
 
-async def publish_order_status(redis_url: str, message: dict[str, Any]) -> None:
-    r = redis.from_url(redis_url, decode_responses=True)
+def _status_stream_key(order_id: str) -> str:
+    return f"{CHANNEL_ORDER_STATUS}:stream:{order_id}"
+
+
+def _status_seq_key(order_id: str) -> str:
+    return f"{CHANNEL_ORDER_STATUS}:seq:{order_id}"
+
+
+# deliver_local runs once the seqs are assigned but before the stream append
+# and PUBLISH, so subscribers on this process don't wait for that round trip;
+# the copy that comes back through redis_listener is dropped by seq.
+async def publish_order_statuses(
+    redis_url: str,
+    items: list[tuple[dict[str, Any], str | None]],
+    *,
+    deliver_local: Callable[[list[dict[str, Any]]], Awaitable[None]] | None = None,
+) -> list[dict[str, Any]]:
+    r = redis.from_url(redis_url)
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            for message, _ in items:
+                pipe.incr(_status_seq_key(message["order_id"]))
+            seqs = await pipe.execute()
+
+        sequenced = [{**message, "seq": seq} for (message, _), seq in zip(items, seqs)]
+        if deliver_local is not None:
+            await deliver_local(sequenced)
+
+        async with r.pipeline(transaction=True) as pipe:
+            for message, (_, user_id) in zip(sequenced, items):
+                order_id = message["order_id"]
+                seq = message["seq"]
+                data = encode(message, settings.message_content_type)
+                pipe.xadd(
+                    _status_stream_key(order_id),
+                    {"seq": seq, "user_id": user_id or "", "data": data},
+                    maxlen=settings.status_stream_maxlen,
+                    approximate=True,
+                )
+                pipe.expire(_status_stream_key(order_id), settings.status_stream_ttl)
+                pipe.expire(_status_seq_key(order_id), settings.status_stream_ttl)
+                pipe.publish(CHANNEL_ORDER_STATUS, data)
+            await pipe.execute()
+    finally:
+        await r.close()
+    return sequenced
+
+
+async def read_order_status_log(redis_url: str, order_id: str) -> list[tuple[str, dict[str, Any]]]:
+    r = redis.from_url(redis_url)
     try:
-        await r.publish(CHANNEL_ORDER_STATUS, json.dumps(message))
+        entries = await r.xrange(_status_stream_key(order_id))
     finally:
         await r.close()
 
+    log = [(fields[b"user_id"].decode("utf-8"), decode(fields[b"data"])) for _, fields in entries]
+    log.sort(key=lambda item: item[1]["seq"])
+    return log
+
+
+async def ping_redis(redis_url: str) -> None:
+    r = redis.from_url(redis_url)
+    try:
+        await r.ping()
+    finally:
+        await r.close()
+
+
+async def wait_for_redis(redis_url: str) -> None:
+    last_err = None
+    for attempt in range(1, 31):
+        try:
+            await ping_redis(redis_url)
+            return
+        except Exception as e:
+            last_err = e
+            await asyncio.sleep(min(2.0, 0.2 * attempt))
+
+    raise RuntimeError(f"Redis connect failed after retries: {last_err}") from last_err
+
 
-async def redis_listener(redis_url: str, ws_manager: WebSocketManager) -> None:
-    r = redis.from_url(redis_url, decode_responses=True)
+async def redis_listener(
+    redis_url: str,
+    ws_manager: WebSocketManager,
+    waiters: StatusWaiters | None = None,
+) -> None:
+    r = redis.from_url(redis_url)
     pubsub = r.pubsub()
     await pubsub.subscribe(CHANNEL_ORDER_STATUS)
     try:
@@ -28,9 +109,11 @@ async def redis_listener(redis_url: str, ws_manager: WebSocketManager) -> None:
                 continue
             data_raw = item.get("data")
             try:
-                message = json.loads(data_raw)
+                message = decode(data_raw)
                 order_id = message.get("order_id")
                 if order_id:
+                    if waiters is not None:
+                        waiters.notify(order_id)
                     await ws_manager.broadcast(order_id, message)
             except Exception:
                 continue
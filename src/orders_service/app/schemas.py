@@ -1,5 +1,6 @@
 from datetime import datetime
 from decimal import Decimal
+from typing import Any
 from uuid import UUID
 
 from pydantic import BaseModel, Field, ConfigDict
@@ -26,3 +27,64 @@ class OrderResponse(BaseModel):
 
 class OrderListResponse(BaseModel):
     orders: list[OrderResponse]
+
+
+class OrderStatsItem(BaseModel):
+    status: OrderStatus
+    count: int
+    total_amount: str
+
+
+class OrderStatsResponse(BaseModel):
+    user_id: str
+    stats: list[OrderStatsItem]
+
+
+class OrderStatusBatchRequest(BaseModel):
+    order_ids: list[UUID] = Field(..., min_length=1, max_length=1000)
+
+
+class OrderStatusItem(BaseModel):
+    id: UUID
+    status: OrderStatus
+    updated_at: datetime
+
+
+class OrderStatusBatchResponse(BaseModel):
+    statuses: list[OrderStatusItem]
+
+
+class DeadLetter(BaseModel):
+    message_id: str | None
+    correlation_id: str | None
+    event_type: str | None
+    retries: int
+    last_error: str | None
+    body: Any
+
+
+class DeadLetterListResponse(BaseModel):
+    queue: str
+    messages: list[DeadLetter]
+
+
+class DeadLetterReplayResponse(BaseModel):
+    queue: str
+    replayed: int
+
+
+class AbandonedOutboxEvent(BaseModel):
+    id: UUID
+    event_type: str
+    aggregate_id: str
+    attempts: int
+    last_error: str | None
+    created_at: datetime
+
+
+class AbandonedOutboxListResponse(BaseModel):
+    events: list[AbandonedOutboxEvent]
+
+
+class AbandonedOutboxRearmResponse(BaseModel):
+    rearmed: int
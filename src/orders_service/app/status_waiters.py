@@ -0,0 +1,24 @@
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class StatusWaiters:
+    def __init__(self) -> None:
+        self._waiters: dict[str, set[asyncio.Event]] = defaultdict(set)
+
+    @contextmanager
+    def watch(self, order_id: str) -> Iterator[asyncio.Event]:
+        event = asyncio.Event()
+        self._waiters[order_id].add(event)
+        try:
+            yield event
+        finally:
+            self._waiters[order_id].discard(event)
+            if not self._waiters[order_id]:
+                self._waiters.pop(order_id, None)
+
+    def notify(self, order_id: str) -> None:
+        for event in self._waiters.get(order_id, ()):
+            event.set()
@@ -1,38 +1,105 @@
 import asyncio
-from collections import defaultdict
+from collections import Counter, defaultdict
 from typing import Any
 
 from fastapi import WebSocket
 
+from .codec import encode_text
+from .models import OrderStatus
+
+
+TERMINAL_STATUSES = frozenset({OrderStatus.FINISHED.value, OrderStatus.CANCELLED.value})
+
+WS_CLOSE_NORMAL = 1000
+WS_CLOSE_GOING_AWAY = 1001
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
 
 class WebSocketManager:
-    def __init__(self) -> None:
+    def __init__(self, *, max_connections: int, max_per_user: int, send_timeout: float) -> None:
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self.send_timeout = send_timeout
         self._lock = asyncio.Lock()
         self._connections: dict[str, set[WebSocket]] = defaultdict(set)
+        self._owners: dict[WebSocket, str] = {}
+        self._per_user: Counter[str] = Counter()
+        self._last_seq: dict[str, int] = {}
 
-    async def connect(self, order_id: str, ws: WebSocket) -> None:
+    async def connect(self, order_id: str, ws: WebSocket, *, user_id: str) -> bool:
         await ws.accept()
         async with self._lock:
-            self._connections[order_id].add(ws)
+            if len(self._owners) >= self.max_connections:
+                reason = "Too many connections"
+            elif self._per_user[user_id] >= self.max_per_user:
+                reason = "Too many connections for this user"
+            else:
+                self._connections[order_id].add(ws)
+                self._owners[ws] = user_id
+                self._per_user[user_id] += 1
+                return True
+
+        await ws.close(code=WS_CLOSE_TRY_AGAIN_LATER, reason=reason)
+        return False
 
     async def disconnect(self, order_id: str, ws: WebSocket) -> None:
         async with self._lock:
-            self._connections[order_id].discard(ws)
-            if not self._connections[order_id]:
+            self._discard(order_id, ws)
+
+    def _discard(self, order_id: str, ws: WebSocket) -> None:
+        user_id = self._owners.pop(ws, None)
+        if user_id is not None:
+            self._per_user[user_id] -= 1
+            if self._per_user[user_id] <= 0:
+                del self._per_user[user_id]
+        conns = self._connections.get(order_id)
+        if conns is not None:
+            conns.discard(ws)
+            if not conns:
                 self._connections.pop(order_id, None)
+                self._last_seq.pop(order_id, None)
+
+    def is_connected(self, ws: WebSocket) -> bool:
+        return ws in self._owners
+
+    def has_subscribers(self, order_id: str) -> bool:
+        return bool(self._connections.get(order_id))
+
+    def stats(self) -> dict[str, int]:
+        return {"connections": len(self._owners), "orders": len(self._connections), "users": len(self._per_user)}
+
+    async def send(self, ws: WebSocket, text: str) -> bool:
+        try:
+            await asyncio.wait_for(ws.send_text(text), self.send_timeout)
+            return True
+        except Exception:
+            return False
+
+    async def close(self, order_id: str, ws: WebSocket, *, code: int, reason: str = "") -> None:
+        async with self._lock:
+            self._discard(order_id, ws)
+        try:
+            await asyncio.wait_for(ws.close(code=code, reason=reason), self.send_timeout)
+        except Exception:
+            pass
 
     async def broadcast(self, order_id: str, message: dict[str, Any]) -> None:
+        seq = message.get("seq")
         async with self._lock:
             targets = list(self._connections.get(order_id, set()))
+            if not targets:
+                return
+            if seq is not None:
+                if seq <= self._last_seq.get(order_id, 0):
+                    return
+                self._last_seq[order_id] = seq
+
+        text = encode_text(message)
+        sent = await asyncio.gather(*(self.send(ws, text) for ws in targets))
+        terminal = message.get("status") in TERMINAL_STATUSES
 
-        dead: list[WebSocket] = []
-        for ws in targets:
-            try:
-                await ws.send_json(message)
-            except Exception:
-                dead.append(ws)
-
-        if dead:
-            async with self._lock:
-                for ws in dead:
-                    self._connections.get(order_id, set()).discard(ws)
+        for ws, ok in zip(targets, sent):
+            if terminal:
+                await self.close(order_id, ws, code=WS_CLOSE_NORMAL, reason="Order completed")
+            elif not ok:
+                await self.close(order_id, ws, code=WS_CLOSE_GOING_AWAY, reason="Send failed")
@@ -0,0 +1,65 @@
+import asyncio
+import signal
+
+from .config import settings
+from .consumer import payment_result_consumer
+from .db import init_db
+from .drain import STAGE_PUBLISHERS, drain
+from .loop_monitor import loop_monitor
+from .idempotency import idempotency_key_reaper
+from .messaging import MessageTransport, RabbitMQ
+from .outbox import outbox_dispatcher
+from .reconcile import reconcile_loop
+from .status_waiters import StatusWaiters
+from .websocket_manager import WebSocketManager
+
+
+def create_rmq() -> MessageTransport:
+    return RabbitMQ(
+        settings.rabbitmq_url,
+        content_type=settings.message_content_type,
+        max_retries=settings.consumer_max_retries,
+        retry_base_delay=settings.consumer_retry_base_delay,
+    )
+
+
+def start_background_tasks(
+    rmq: MessageTransport,
+    ws_manager: WebSocketManager | None = None,
+    status_waiters: StatusWaiters | None = None,
+) -> list[asyncio.Task]:
+    tasks = [
+        drain.track(asyncio.create_task(outbox_dispatcher(rmq)), STAGE_PUBLISHERS),
+        drain.track(asyncio.create_task(payment_result_consumer(rmq, settings.redis_url, ws_manager, status_waiters))),
+        asyncio.create_task(idempotency_key_reaper()),
+    ]
+    if settings.reconcile_interval > 0 and settings.payments_database_url:
+        tasks.append(asyncio.create_task(reconcile_loop()))
+    return tasks
+
+
+async def run() -> None:
+    rmq = create_rmq()
+    await asyncio.gather(init_db(), rmq.connect())
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    tasks = start_background_tasks(rmq)
+    if settings.loop_monitor_enabled:
+        tasks.append(asyncio.create_task(loop_monitor.run()))
+    stop_task = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait([stop_task, *tasks], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        await drain.drain(settings.shutdown_drain_timeout)
+        for t in [stop_task, *tasks]:
+            t.cancel()
+        await asyncio.gather(stop_task, *tasks, return_exceptions=True)
+        await rmq.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
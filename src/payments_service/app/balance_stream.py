@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from decimal import Decimal
+from typing import Any
+
+from fastapi import WebSocket
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from .codec import decode, encode_text
+from .models import Account, TxKind
+
+
+logger = logging.getLogger(__name__)
+
+BALANCE_CHANNEL = "balance_changes"
+
+WS_CLOSE_GOING_AWAY = 1001
+WS_CLOSE_SERVICE_RESTART = 1012
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+NOTIFY_SQL = text("SELECT pg_notify(:channel, :payload)")
+
+PING_TEXT = encode_text({"type": "ping"})
+
+
+# NOTIFY is queued with the transaction and only delivered once it commits,
+# so a rolled-back debit or topup never reaches a client.
+async def notify_balance_change(
+    session: AsyncSession,
+    acc: Account,
+    *,
+    delta: Decimal,
+    kind: TxKind,
+    order_id: str | None = None,
+) -> None:
+    payload = encode_text({
+        "type": "delta",
+        "user_id": acc.user_id,
+        "balance": f"{acc.balance:.2f}",
+        "delta": f"{delta:.2f}",
+        "kind": kind.value,
+        "order_id": order_id,
+        "version": acc.version,
+    })
+    await session.execute(NOTIFY_SQL, {"channel": BALANCE_CHANNEL, "payload": payload})
+
+
+def balance_snapshot(user_id: str, acc: Account | None) -> dict[str, Any]:
+    return {
+        "type": "snapshot",
+        "user_id": user_id,
+        "balance": f"{acc.balance:.2f}" if acc else "0.00",
+        "version": acc.version if acc else 0,
+    }
+
+
+class BalanceHub:
+    def __init__(self, *, max_connections: int, max_per_user: int, send_timeout: float) -> None:
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self.send_timeout = send_timeout
+        self._lock = asyncio.Lock()
+        self._connections: dict[str, set[WebSocket]] = defaultdict(set)
+        self._owners: dict[WebSocket, str] = {}
+        self._per_user: Counter[str] = Counter()
+        self._versions: dict[WebSocket, int] = {}
+        self._send_locks: dict[WebSocket, asyncio.Lock] = {}
+
+    async def connect(self, user_id: str, ws: WebSocket) -> bool:
+        await ws.accept()
+        async with self._lock:
+            if len(self._owners) >= self.max_connections:
+                reason = "Too many connections"
+            elif self._per_user[user_id] >= self.max_per_user:
+                reason = "Too many connections for this user"
+            else:
+                self._connections[user_id].add(ws)
+                self._owners[ws] = user_id
+                self._per_user[user_id] += 1
+                self._versions[ws] = -1
+                self._send_locks[ws] = asyncio.Lock()
+                return True
+
+        await ws.close(code=WS_CLOSE_TRY_AGAIN_LATER, reason=reason)
+        return False
+
+    async def disconnect(self, ws: WebSocket) -> None:
+        async with self._lock:
+            self._discard(ws)
+
+    def _discard(self, ws: WebSocket) -> None:
+        user_id = self._owners.pop(ws, None)
+        self._versions.pop(ws, None)
+        self._send_locks.pop(ws, None)
+        if user_id is None:
+            return
+        self._per_user[user_id] -= 1
+        if self._per_user[user_id] <= 0:
+            del self._per_user[user_id]
+        conns = self._connections.get(user_id)
+        if conns is not None:
+            conns.discard(ws)
+            if not conns:
+                self._connections.pop(user_id, None)
+
+    def is_connected(self, ws: WebSocket) -> bool:
+        return ws in self._owners
+
+    def stats(self) -> dict[str, int]:
+        return {"connections": len(self._owners), "users": len(self._connections)}
+
+    async def send(self, ws: WebSocket, text: str) -> bool:
+        try:
+            await asyncio.wait_for(ws.send_text(text), self.send_timeout)
+            return True
+        except Exception:
+            return False
+
+    async def close(self, ws: WebSocket, *, code: int, reason: str = "") -> None:
+        async with self._lock:
+            self._discard(ws)
+        try:
+            await asyncio.wait_for(ws.close(code=code, reason=reason), self.send_timeout)
+        except Exception:
+            pass
+
+    # The snapshot and the deltas race each other on a fresh socket; the
+    # account version lets whichever is older be dropped instead of
+    # overwriting a newer balance on the client.
+    async def deliver(self, ws: WebSocket, message: dict[str, Any]) -> bool:
+        send_lock = self._send_locks.get(ws)
+        if send_lock is None:
+            return False
+        async with send_lock:
+            if message["version"] <= self._versions.get(ws, -1):
+                return True
+            if not await self.send(ws, encode_text(message)):
+                return False
+            self._versions[ws] = message["version"]
+            return True
+
+    async def ping(self, ws: WebSocket) -> bool:
+        send_lock = self._send_locks.get(ws)
+        if send_lock is None:
+            return False
+        async with send_lock:
+            return await self.send(ws, PING_TEXT)
+
+    async def publish(self, message: dict[str, Any]) -> None:
+        async with self._lock:
+            targets = list(self._connections.get(message["user_id"], set()))
+        if not targets:
+            return
+
+        sent = await asyncio.gather(*(self.deliver(ws, message) for ws in targets))
+        for ws, ok in zip(targets, sent):
+            if not ok:
+                await self.close(ws, code=WS_CLOSE_GOING_AWAY, reason="Send failed")
+
+    async def close_all(self, *, code: int, reason: str = "") -> None:
+        async with self._lock:
+            targets = list(self._owners)
+        await asyncio.gather(*(self.close(ws, code=code, reason=reason) for ws in targets))
+
+
+async def balance_listener(engine: AsyncEngine, hub: BalanceHub, *, retry_delay: float = 1.0) -> None:
+    while True:
+        try:
+            async with engine.connect() as conn:
+                raw = (await conn.get_raw_connection()).driver_connection
+                events: asyncio.Queue[str | None] = asyncio.Queue()
+
+                def on_notify(_conn, _pid, _channel, payload: str) -> None:
+                    events.put_nowait(payload)
+
+                raw.add_termination_listener(lambda _conn: events.put_nowait(None))
+                await raw.add_listener(BALANCE_CHANNEL, on_notify)
+                try:
+                    while (payload := await events.get()) is not None:
+                        try:
+                            message = decode(payload)
+                            if message.get("user_id"):
+                                await hub.publish(message)
+                        except Exception:
+                            continue
+                finally:
+                    if not raw.is_closed():
+                        await raw.remove_listener(BALANCE_CHANNEL, on_notify)
+            raise ConnectionError("balance listener connection closed")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("balance listener failed, reconnecting in %.1fs", retry_delay)
+
+        # Anything committed while we were not listening is lost; make the
+        # clients reconnect and pick up a fresh snapshot instead.
+        await hub.close_all(code=WS_CLOSE_SERVICE_RESTART, reason="Balance stream restarted")
+        await asyncio.sleep(retry_delay)
@@ -0,0 +1,46 @@
+from datetime import datetime
+from typing import Any
+
+import msgpack
+import orjson
+
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+
+SUPPORTED_CONTENT_TYPES = (CONTENT_TYPE_JSON, CONTENT_TYPE_MSGPACK)
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
+
+
+def encode(obj: Any, content_type: str = CONTENT_TYPE_JSON) -> bytes:
+    if content_type == CONTENT_TYPE_JSON:
+        return orjson.dumps(obj, default=_default)
+    if content_type == CONTENT_TYPE_MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True, default=_default)
+    raise ValueError(f"Unsupported content type: {content_type}")
+
+
+def encode_text(obj: Any) -> str:
+    return orjson.dumps(obj, default=_default).decode("utf-8")
+
+
+def decode(body: bytes | str, content_type: str | None = None) -> Any:
+    if isinstance(body, str):
+        return orjson.loads(body)
+    if content_type not in SUPPORTED_CONTENT_TYPES:
+        content_type = _sniff(body)
+    if content_type == CONTENT_TYPE_MSGPACK:
+        return msgpack.unpackb(body, raw=False)
+    return orjson.loads(body)
+
+
+def _sniff(body: bytes) -> str:
+    head = body.lstrip()[:1]
+    if head in (b"{", b"["):
+        return CONTENT_TYPE_JSON
+    return CONTENT_TYPE_MSGPACK
@@ -1,32 +1,99 @@
-import json
+import asyncio
+import logging
+import socket
+import uuid
 from decimal import Decimal
 from typing import Any
 
+from .codec import decode
 from .config import settings
 from .crud import process_payment_requested
 from .db import SessionLocal
-from .messaging import RabbitMQ
+from .drain import Drain, drain
+from .messaging import QUEUE_PAYMENTS_REQUESTS, MessageTransport, payment_request_queue_name
+from .sharding import claim_shards, release_shards
 
 
-def _parse_message(body: bytes) -> dict[str, Any]:
-    return json.loads(body.decode("utf-8"))
+logger = logging.getLogger(__name__)
 
 
-async def payment_requested_consumer(rmq: RabbitMQ) -> None:
-    queue = await rmq.declare_payments_requests_queue()
+def _parse_message(msg) -> dict[str, Any]:
+    return decode(msg.body, msg.content_type)
 
+
+# Each consumer gets its own single-stage Drain so a revoked shard can stop
+# taking deliveries, finish and ack the one in flight, and only then be
+# cancelled. Cancelling mid-handler would leave that delivery unacked on the
+# shared channel until it closes.
+def _start(rmq: MessageTransport, queue, queue_name: str) -> tuple[asyncio.Task, Drain]:
+    stop = Drain(stages=1)
+    return stop.track(asyncio.create_task(_consume(rmq, queue, queue_name, stop))), stop
+
+
+async def payment_requested_consumer(rmq: MessageTransport) -> None:
+    legacy_queue = await rmq.declare_payments_requests_queue()
+    shard_queues = {
+        shard: await rmq.declare_payment_request_shard_queue(shard)
+        for shard in range(settings.payment_request_shards)
+    }
+
+    def start(shard: int | None) -> tuple[asyncio.Task, Drain]:
+        if shard is None:
+            return _start(rmq, legacy_queue, QUEUE_PAYMENTS_REQUESTS)
+        return _start(rmq, shard_queues[shard], payment_request_queue_name(shard))
+
+    consumers: dict[int | None, tuple[asyncio.Task, Drain]] = {None: start(None)}
+    member_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+    try:
+        while not drain.draining():
+            for shard, (task, _) in list(consumers.items()):
+                if task.done():
+                    if not task.cancelled() and task.exception() is not None:
+                        logger.error("consumer for shard %s died, restarting", shard, exc_info=task.exception())
+                    consumers[shard] = start(shard)
+
+            if shard_queues:
+                try:
+                    owned = await claim_shards(member_id)
+                except Exception:
+                    owned = {shard for shard in consumers if shard is not None}
+
+                revoked = [consumers.pop(s) for s in list(consumers) if s is not None and s not in owned]
+                await asyncio.gather(*(stop.drain(settings.shutdown_drain_timeout) for _, stop in revoked))
+                for shard in owned - consumers.keys():
+                    consumers[shard] = start(shard)
+
+            await drain.sleep(settings.shard_heartbeat_interval)
+
+        await asyncio.gather(*(stop.drain(settings.shutdown_drain_timeout) for _, stop in consumers.values()))
+    finally:
+        tasks = [task for task, _ in consumers.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if shard_queues:
+            try:
+                await release_shards(member_id)
+            except Exception:
+                pass
+
+
+async def _consume(rmq: MessageTransport, queue, queue_name: str, stop: Drain) -> None:
     async with queue.iterator() as q:
-        async for msg in q:
+        async for msg in stop.messages(q):
             try:
                 await _handle_payment_requested(msg=msg)
                 await msg.ack()
-            except Exception:
-                await msg.nack(requeue=True)
+            except Exception as e:
+                try:
+                    await rmq.retry_or_dead_letter(msg, queue_name=queue_name, error=e)
+                except Exception:
+                    await msg.nack(requeue=True)
 
 
 async def _handle_payment_requested(*, msg) -> None:
     message_id = msg.message_id or ""
-    envelope = _parse_message(msg.body)
+    envelope = _parse_message(msg)
     payload = envelope.get("payload", {})
 
     order_id = payload.get("order_id")
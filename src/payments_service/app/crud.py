@@ -6,6 +6,9 @@ from sqlalchemy import select
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from .balance_stream import notify_balance_change
+from .codec import encode
+from .config import settings
 from .models import (
     Account,
     BalanceTransaction,
@@ -44,12 +47,14 @@ async def topup(session: AsyncSession, *, user_id: str, amount: Decimal) -> Acco
         acc = await get_account_for_update(session, user_id=user_id)
 
     acc.balance = Decimal(acc.balance) + amount
+    acc.version += 1
     session.add(BalanceTransaction(
         user_id=user_id,
         kind=TxKind.topup,
         amount=amount,
         order_id=None,
     ))
+    await notify_balance_change(session, acc, delta=amount, kind=TxKind.topup)
     return acc
 
 
@@ -111,12 +116,14 @@ async def process_payment_requested(
         current = Decimal(acc.balance)
         if current >= amount:
             acc.balance = current - amount
+            acc.version += 1
             session.add(BalanceTransaction(
                 user_id=user_id,
                 kind=TxKind.order_debit,
                 amount=-amount,
                 order_id=order_id,
             ))
+            await notify_balance_change(session, acc, delta=-amount, kind=TxKind.order_debit, order_id=order_id)
             status = PaymentStatus.succeeded
             reason = None
         else:
@@ -166,5 +173,7 @@ def _make_payment_result_outbox(
         event_type="PaymentResult",
         aggregate_type="Payment",
         aggregate_id=order_id,
-        payload=envelope,
+        body=encode(envelope, settings.message_content_type),
+        content_type=settings.message_content_type,
+        payload=envelope if settings.outbox_store_debug_payload else None,
     )
@@ -1,3 +1,11 @@
+import asyncio
+import math
+import time
+from collections.abc import Mapping
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from fastapi import Request, Response
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 
 from .config import settings
@@ -17,12 +25,140 @@ SessionLocal = async_sessionmaker(
     autoflush=False,
 )
 
+replica_engine: AsyncEngine | None = (
+    create_async_engine(settings.database_replica_url, echo=False, pool_pre_ping=True)
+    if settings.database_replica_url
+    else None
+)
+
+ReplicaSessionLocal = (
+    async_sessionmaker(
+        bind=replica_engine,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        autoflush=False,
+    )
+    if replica_engine is not None
+    else None
+)
+
+READ_YOUR_WRITES_COOKIE = "rw_until"
+
+REPLICA_LAG_SQL = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+SCHEMA_LOCK_KEY = 4_240_001
+SCHEMA_VERSION = 5
+
+SCHEMA_UPGRADES = (
+    "ALTER TABLE outbox_events ADD COLUMN IF NOT EXISTS body BYTEA",
+    "ALTER TABLE outbox_events ADD COLUMN IF NOT EXISTS content_type VARCHAR(64)",
+    "ALTER TABLE outbox_events ALTER COLUMN payload DROP NOT NULL",
+    "ALTER TABLE outbox_events ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ",
+    "ALTER TABLE outbox_events ADD COLUMN IF NOT EXISTS routing_key VARCHAR(256)",
+    "CREATE INDEX IF NOT EXISTS ix_outbox_events_pending ON outbox_events (created_at) WHERE published_at IS NULL",
+    "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0",
+)
+
+
+async def _schema_version(conn) -> int | None:
+    exists = await conn.scalar(text("SELECT to_regclass('schema_version') IS NOT NULL"))
+    if not exists:
+        return None
+    return await conn.scalar(text("SELECT max(version) FROM schema_version"))
+
+
+async def _migrate() -> bool:
+    async with engine.connect() as conn:
+        if await _schema_version(conn) == SCHEMA_VERSION:
+            return False
 
-async def init_db() -> None:
     async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        if await _schema_version(conn) == SCHEMA_VERSION:
+            return False
         await conn.run_sync(Base.metadata.create_all)
+        for ddl in SCHEMA_UPGRADES:
+            await conn.execute(text(ddl))
+        await conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        await conn.execute(text("DELETE FROM schema_version"))
+        await conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": SCHEMA_VERSION})
+    return True
+
+
+async def init_db() -> bool:
+    last_err = None
+    for attempt in range(1, 31):
+        try:
+            return await _migrate()
+        except (DBAPIError, OSError) as e:
+            last_err = e
+            await asyncio.sleep(min(2.0, 0.2 * attempt))
+
+    raise RuntimeError(f"Database connect failed after retries: {last_err}") from last_err
+
+
+async def check_db() -> None:
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
 
 
 async def get_session():
     async with SessionLocal() as session:
         yield session
+
+
+class ReplicaLag:
+    def __init__(self) -> None:
+        self.seconds: float | None = None
+
+    def healthy(self) -> bool:
+        return self.seconds is not None and self.seconds <= settings.replica_max_lag
+
+
+replica_lag = ReplicaLag()
+
+
+async def replica_lag_monitor() -> None:
+    assert replica_engine is not None
+
+    while True:
+        try:
+            async with replica_engine.connect() as conn:
+                replica_lag.seconds = float(await conn.scalar(text(REPLICA_LAG_SQL)))
+        except Exception:
+            replica_lag.seconds = None
+
+        await asyncio.sleep(settings.replica_lag_check_interval)
+
+
+def mark_write(response: Response) -> None:
+    window = settings.read_your_writes_window
+    response.set_cookie(
+        READ_YOUR_WRITES_COOKIE,
+        f"{time.time() + window:.3f}",
+        max_age=math.ceil(window),
+        httponly=True,
+        samesite="lax",
+    )
+
+
+def _wrote_recently(cookies: Mapping[str, str]) -> bool:
+    try:
+        return float(cookies.get(READ_YOUR_WRITES_COOKIE, "0")) > time.time()
+    except ValueError:
+        return False
+
+
+def read_sessionmaker(cookies: Mapping[str, str]) -> async_sessionmaker[AsyncSession]:
+    if ReplicaSessionLocal is None or not replica_lag.healthy() or _wrote_recently(cookies):
+        return SessionLocal
+    return ReplicaSessionLocal
+
+
+async def get_read_session(request: Request):
+    async with read_sessionmaker(request.cookies)() as session:
+        yield session
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterable, AsyncIterator
+from contextlib import suppress
+from typing import Any, TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Consumers stop first so whatever they write to the outbox is still picked
+# up by the publishers' final flush in the next stage.
+STAGE_CONSUMERS = 0
+STAGE_PUBLISHERS = 1
+
+
+class Drain:
+    def __init__(self, stages: int = 2) -> None:
+        self._events = [asyncio.Event() for _ in range(stages)]
+        self._tasks: list[set[asyncio.Task]] = [set() for _ in range(stages)]
+
+    def track(self, task: asyncio.Task, stage: int = STAGE_CONSUMERS) -> asyncio.Task:
+        self._tasks[stage].add(task)
+        task.add_done_callback(self._tasks[stage].discard)
+        return task
+
+    def draining(self, stage: int = STAGE_CONSUMERS) -> bool:
+        return self._events[stage].is_set()
+
+    async def _race(self, aw, stage: int) -> tuple[bool, Any]:
+        if self.draining(stage):
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            return False, None
+        work = asyncio.ensure_future(aw)
+        stop = asyncio.ensure_future(self._events[stage].wait())
+        try:
+            await asyncio.wait({work, stop}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop.cancel()
+            if not work.done():
+                work.cancel()
+                with suppress(asyncio.CancelledError):
+                    await work
+        if work.cancelled():
+            return False, None
+        return True, work.result()
+
+    async def sleep(self, delay: float, stage: int = STAGE_CONSUMERS) -> bool:
+        await self._race(asyncio.sleep(delay), stage)
+        return self.draining(stage)
+
+    async def get(self, queue: asyncio.Queue, stage: int = STAGE_CONSUMERS) -> tuple[bool, Any]:
+        return await self._race(queue.get(), stage)
+
+    async def messages(self, source: AsyncIterable[T], stage: int = STAGE_CONSUMERS) -> AsyncIterator[T]:
+        it = source.__aiter__()
+        while True:
+            try:
+                ok, item = await self._race(it.__anext__(), stage)
+            except StopAsyncIteration:
+                return
+            if not ok:
+                return
+            yield item
+
+    async def drain(self, timeout: float) -> float:
+        started = time.monotonic()
+        deadline = started + timeout
+        cut_off = 0
+        for event, tasks in zip(self._events, self._tasks):
+            event.set()
+            pending = set(tasks)
+            if pending:
+                _, pending = await asyncio.wait(pending, timeout=max(0.0, deadline - time.monotonic()))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            cut_off += len(pending)
+
+        elapsed = time.monotonic() - started
+        logger.info("drained in %.3fs (%d task(s) cancelled at the %.1fs deadline)", elapsed, cut_off, timeout)
+        return elapsed
+
+
+drain = Drain()
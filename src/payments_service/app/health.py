@@ -0,0 +1,40 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+
+Check = Callable[[], Awaitable[None]]
+
+
+class HealthChecker:
+    def __init__(self, checks: dict[str, Check], *, ttl: float, timeout: float) -> None:
+        self.checks = checks
+        self.ttl = ttl
+        self.timeout = timeout
+
+        self._lock = asyncio.Lock()
+        self._results: dict[str, str] = {}
+        self._checked_at = float("-inf")
+
+    async def _run(self, check: Check) -> str:
+        try:
+            await asyncio.wait_for(check(), timeout=self.timeout)
+            return "ok"
+        except Exception as e:
+            return f"error: {type(e).__name__}"
+
+    async def results(self) -> dict[str, str]:
+        if time.monotonic() - self._checked_at < self.ttl:
+            return self._results
+
+        async with self._lock:
+            if time.monotonic() - self._checked_at >= self.ttl:
+                names = list(self.checks)
+                outcomes = await asyncio.gather(*(self._run(self.checks[name]) for name in names))
+                self._results = dict(zip(names, outcomes))
+                self._checked_at = time.monotonic()
+        return self._results
+
+    async def ready(self) -> tuple[bool, dict[str, str]]:
+        results = await self.results()
+        return all(v == "ok" for v in results.values()), results
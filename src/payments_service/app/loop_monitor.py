@@ -0,0 +1,135 @@
+import asyncio
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LagHistogram:
+    def __init__(self, buckets: tuple[float, ...] = LAG_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> dict:
+        cumulative, buckets = 0, {}
+        for bound, n in zip((*self.buckets, float("inf")), self.counts):
+            cumulative += n
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {"count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6), "buckets": buckets}
+
+    def prometheus(self, name: str) -> str:
+        snap = self.snapshot()
+        lines = [f"# TYPE {name} histogram"]
+        lines += [f'{name}_bucket{{le="{le}"}} {n}' for le, n in snap["buckets"].items()]
+        lines += [f"{name}_sum {self.sum}", f"{name}_count {self.count}"]
+        return "\n".join(lines) + "\n"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name}@{os.path.basename(code.co_filename)}:{frame.f_lineno}"
+
+
+def _collapsed(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+# The loop thread stamps a heartbeat; a watchdog thread notices when it goes
+# stale and dumps the loop thread's stack while it is still blocked, which is
+# the only point where the culprit is still visible.
+class LoopLagMonitor:
+    def __init__(self, *, interval: float, slow_threshold: float, report_interval: float) -> None:
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.report_interval = report_interval
+        self.histogram = LagHistogram()
+        self.loop_thread_id: int | None = None
+        self._heartbeat = time.monotonic()
+        self._stop = threading.Event()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        watchdog.start()
+
+        next_report = loop.time() + self.report_interval
+        try:
+            while True:
+                started = loop.time()
+                await asyncio.sleep(self.interval)
+                now = loop.time()
+                self._heartbeat = time.monotonic()
+                self.histogram.observe(max(0.0, now - started - self.interval))
+                if now >= next_report:
+                    next_report = now + self.report_interval
+                    logger.info("event loop lag: %s", self.histogram.snapshot())
+        finally:
+            self._stop.set()
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stop.wait(self.slow_threshold / 2):
+            beat = self._heartbeat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.slow_threshold or reported == beat:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            reported = beat
+            logger.warning(
+                "event loop blocked for %.3fs so far, loop thread stack:\n%s",
+                stalled,
+                "".join(traceback.format_stack(frame)),
+            )
+
+
+loop_monitor = LoopLagMonitor(
+    interval=settings.loop_monitor_interval,
+    slow_threshold=settings.loop_slow_threshold,
+    report_interval=settings.loop_lag_report_interval,
+)
+
+
+async def sample_profile(thread_id: int | None, *, duration: float, interval: float) -> str:
+    def sample() -> str:
+        me = threading.get_ident()
+        stacks: Counter[str] = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (thread_id is not None and ident != thread_id):
+                    continue
+                stacks[_collapsed(frame)] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+
+    return await asyncio.to_thread(sample)
@@ -1,20 +1,64 @@
 import asyncio
+import logging
+import os
+import threading
+import time
 from contextlib import asynccontextmanager
 from decimal import Decimal
 
-from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from .balance_stream import BalanceHub, balance_listener, balance_snapshot
 from .config import settings
 from .crud import create_account, get_balance, topup
-from .db import get_session, init_db
-from .messaging import RabbitMQ
-from .outbox import outbox_dispatcher
-from .consumer import payment_requested_consumer
-from .schemas import BalanceResponse, CreateAccountResponse, TopUpRequest, TopUpResponse
+from .db import (
+    SessionLocal,
+    check_db,
+    engine,
+    get_read_session,
+    get_session,
+    init_db,
+    mark_write,
+    replica_engine,
+    replica_lag_monitor,
+)
+from .drain import drain
+from .health import HealthChecker
+from .loop_monitor import loop_monitor, sample_profile
+from .messaging import QUEUE_PAYMENTS_REQUESTS, dead_letter_queue_name, payment_request_queue_name
+from .outbox import count_abandoned, list_abandoned, rearm_abandoned
+from .schemas import (
+    AbandonedOutboxListResponse,
+    AbandonedOutboxRearmResponse,
+    BalanceResponse,
+    CreateAccountResponse,
+    DeadLetterListResponse,
+    DeadLetterReplayResponse,
+    TopUpRequest,
+    TopUpResponse,
+)
+from .worker import create_rmq, start_background_tasks
+
 
+logger = logging.getLogger(__name__)
 
-rmq = RabbitMQ(settings.rabbitmq_url)
+rmq = create_rmq()
+profile_lock = asyncio.Lock()
+balance_hub = BalanceHub(
+    max_connections=settings.ws_max_connections,
+    max_per_user=settings.ws_max_per_user,
+    send_timeout=settings.ws_send_timeout,
+)
+readiness = HealthChecker(
+    {
+        "postgres": check_db,
+        "rabbitmq": rmq.check,
+    },
+    ttl=settings.readiness_cache_ttl,
+    timeout=settings.readiness_check_timeout,
+)
 
 
 async def _require_user_id(x_user_id: str | None = Header(default=None, alias="X-User-Id")) -> str:
@@ -23,18 +67,30 @@ async def _require_user_id(x_user_id: str | None = Header(default=None, alias="X
     return x_user_id
 
 
+async def _require_admin(x_admin_token: str | None = Header(default=None, alias="X-Admin-Token")) -> None:
+    if not settings.admin_token or x_admin_token != settings.admin_token:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
-    await rmq.connect()
+    started = time.perf_counter()
+    migrated, _ = await asyncio.gather(init_db(), rmq.connect())
+    app.state.startup_seconds = time.perf_counter() - started
+    logger.info("startup completed in %.3fs (schema migrated: %s)", app.state.startup_seconds, migrated)
 
-    tasks: list[asyncio.Task] = []
-    tasks.append(asyncio.create_task(outbox_dispatcher(rmq)))
-    tasks.append(asyncio.create_task(payment_requested_consumer(rmq)))
+    tasks: list[asyncio.Task] = [asyncio.create_task(balance_listener(engine, balance_hub))]
+    if settings.run_background_workers:
+        tasks.extend(start_background_tasks(rmq))
+    if replica_engine is not None:
+        tasks.append(asyncio.create_task(replica_lag_monitor()))
+    if settings.loop_monitor_enabled:
+        tasks.append(asyncio.create_task(loop_monitor.run()))
 
     try:
         yield
     finally:
+        await drain.drain(settings.shutdown_drain_timeout)
         for t in tasks:
             t.cancel()
         await rmq.close()
@@ -44,6 +100,7 @@ app = FastAPI(
     title="Payments Service",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     docs_url="/payments/docs",
     openapi_url="/payments/openapi.json",
 )
@@ -54,20 +111,125 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+async def ready():
+    ok, checks = await readiness.ready()
+    return ORJSONResponse(
+        {
+            "status": "ready" if ok else "unavailable",
+            "startup_seconds": round(app.state.startup_seconds, 3),
+            "checks": checks,
+        },
+        status_code=200 if ok else 503,
+    )
+
+
+def _consumer_queue(shard: int | None) -> str:
+    if shard is None:
+        return QUEUE_PAYMENTS_REQUESTS
+    if shard >= settings.payment_request_shards:
+        raise HTTPException(status_code=404, detail="Unknown shard")
+    return payment_request_queue_name(shard)
+
+
+@app.get("/admin/dead-letters", response_model=DeadLetterListResponse, dependencies=[Depends(_require_admin)])
+async def admin_list_dead_letters(
+    limit: int = Query(100, ge=1, le=1000),
+    shard: int | None = Query(None, ge=0),
+):
+    queue_name = _consumer_queue(shard)
+    messages = await rmq.list_dead_letters(queue_name, limit=limit)
+    return {"queue": dead_letter_queue_name(queue_name), "messages": messages}
+
+
+@app.post("/admin/dead-letters/replay", response_model=DeadLetterReplayResponse, dependencies=[Depends(_require_admin)])
+async def admin_replay_dead_letters(
+    limit: int = Query(100, ge=1, le=1000),
+    shard: int | None = Query(None, ge=0),
+):
+    queue_name = _consumer_queue(shard)
+    replayed = await rmq.replay_dead_letters(queue_name, limit=limit)
+    return {"queue": dead_letter_queue_name(queue_name), "replayed": replayed}
+
+
+@app.get("/admin/outbox/abandoned", response_model=AbandonedOutboxListResponse, dependencies=[Depends(_require_admin)])
+async def admin_list_abandoned_outbox(
+    limit: int = Query(100, ge=1, le=1000),
+    session: AsyncSession = Depends(get_session),
+):
+    return {"events": await list_abandoned(session, limit=limit)}
+
+
+@app.post(
+    "/admin/outbox/abandoned/rearm",
+    response_model=AbandonedOutboxRearmResponse,
+    dependencies=[Depends(_require_admin)],
+)
+async def admin_rearm_abandoned_outbox(
+    limit: int = Query(100, ge=1, le=1000),
+    session: AsyncSession = Depends(get_session),
+):
+    async with session.begin():
+        rearmed = await rearm_abandoned(session, limit=limit)
+    return {"rearmed": rearmed}
+
+
+async def _outbox_gauges() -> str:
+    try:
+        async with SessionLocal() as session:
+            abandoned = await count_abandoned(session)
+    except Exception:
+        return ""
+    name = f"{settings.service_name}_outbox_abandoned_events"
+    return f"# TYPE {name} gauge\n{name} {abandoned}\n"
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        loop_monitor.histogram.prometheus(f"{settings.service_name}_event_loop_lag_seconds") + await _outbox_gauges(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.get("/admin/loop-lag", dependencies=[Depends(_require_admin)])
+async def admin_loop_lag():
+    return loop_monitor.histogram.snapshot()
+
+
+@app.post("/admin/profile", dependencies=[Depends(_require_admin)])
+async def admin_profile(
+    seconds: float = Query(5.0, gt=0, le=settings.profile_max_seconds),
+    all_threads: bool = Query(False),
+):
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    async with profile_lock:
+        collapsed = await sample_profile(
+            None if all_threads else threading.get_ident(),
+            duration=seconds,
+            interval=settings.profile_sample_interval,
+        )
+    filename = f"{settings.service_name}-{os.getpid()}-{int(time.time())}.collapsed"
+    return PlainTextResponse(collapsed, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 @app.post("/accounts", response_model=CreateAccountResponse)
 async def api_create_account(
+    response: Response,
     user_id: str = Depends(_require_user_id),
     session: AsyncSession = Depends(get_session),
 ):
     async with session.begin():
         acc = await create_account(session, user_id=user_id)
+    mark_write(response)
     return {"user_id": acc.user_id, "balance": f"{acc.balance:.2f}"}
 
 
 @app.get("/accounts/balance", response_model=BalanceResponse)
 async def api_balance(
     user_id: str = Depends(_require_user_id),
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
 ):
     acc = await get_balance(session, user_id=user_id)
     if not acc:
@@ -78,10 +240,53 @@ async def api_balance(
 @app.post("/accounts/topup", response_model=TopUpResponse)
 async def api_topup(
     body: TopUpRequest,
+    response: Response,
     user_id: str = Depends(_require_user_id),
     session: AsyncSession = Depends(get_session),
 ):
     amount = Decimal(body.amount)
     async with session.begin():
         acc = await topup(session, user_id=user_id, amount=amount)
+    mark_write(response)
     return {"user_id": acc.user_id, "balance": f"{acc.balance:.2f}"}
+
+
+# Liveness is uvicorn's protocol-level ping/pong (--ws-ping-interval and
+# --ws-ping-timeout); the JSON ping is only keep-alive traffic and clients
+# never have to answer it.
+async def _ws_heartbeat(ws: WebSocket) -> None:
+    while balance_hub.is_connected(ws):
+        try:
+            await asyncio.wait_for(ws.receive_text(), settings.ws_ping_interval or None)
+            continue
+        except asyncio.TimeoutError:
+            pass
+        if balance_hub.is_connected(ws) and not await balance_hub.ping(ws):
+            return
+
+
+@app.websocket("/ws/accounts/balance")
+async def ws_account_balance(ws: WebSocket, user_id: str | None = None):
+    if not user_id:
+        await ws.close(code=1008)
+        return
+
+    if not await balance_hub.connect(user_id, ws):
+        return
+    try:
+        # Subscribed before reading, and from the primary, so the snapshot is
+        # never older than the first delta the client can miss.
+        async with SessionLocal() as session:
+            acc = await get_balance(session, user_id=user_id)
+        if not await balance_hub.deliver(ws, balance_snapshot(user_id, acc)):
+            return
+        await _ws_heartbeat(ws)
+    except WebSocketDisconnect:
+        pass
+    except RuntimeError:
+        # Starlette raises this for a socket we already closed ourselves;
+        # anything else is a real failure.
+        if balance_hub.is_connected(ws):
+            logger.exception("balance websocket for user %s failed", user_id)
+    finally:
+        await balance_hub.disconnect(ws)
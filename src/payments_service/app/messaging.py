@@ -1,10 +1,13 @@
-import json
-from typing import Any
+from abc import ABC, abstractmethod
+from typing import Any, Protocol
 import asyncio
+import hashlib
 
 import aio_pika
 from aio_pika import DeliveryMode, ExchangeType, Message
 
+from .codec import CONTENT_TYPE_JSON, decode, encode
+
 
 EXCHANGE_NAME = "events"
 
@@ -14,9 +17,101 @@ RK_PAYMENT_RESULT = "orders.payment_result"
 QUEUE_PAYMENTS_REQUESTS = "payments.payment_requests"
 
 
-class RabbitMQ:
-    def __init__(self, url: str):
+HEADER_RETRY_COUNT = "x-retry-count"
+HEADER_LAST_ERROR = "x-last-error"
+
+
+def retry_queue_name(queue_name: str, delay_ms: int) -> str:
+    return f"{queue_name}.retry.{delay_ms}"
+
+
+def dead_letter_queue_name(queue_name: str) -> str:
+    return f"{queue_name}.dead"
+
+
+def payment_request_shard(user_id: str, shards: int) -> int:
+    digest = hashlib.blake2b(user_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def payment_request_routing_key(shard: int) -> str:
+    return f"{RK_PAYMENT_REQUESTED}.{shard}"
+
+
+def payment_request_queue_name(shard: int) -> str:
+    return f"{QUEUE_PAYMENTS_REQUESTS}.{shard}"
+
+
+class MessageTransport(Protocol):
+    content_type: str
+
+    async def connect(self) -> None: ...
+
+    async def close(self) -> None: ...
+
+    async def check(self) -> None: ...
+
+    async def publish_json(
+        self,
+        *,
+        routing_key: str,
+        body: dict[str, Any],
+        message_id: str,
+        correlation_id: str | None = None,
+        headers: dict[str, Any] | None = None,
+    ) -> None: ...
+
+    async def publish_bytes(
+        self,
+        *,
+        routing_key: str,
+        body: bytes,
+        content_type: str,
+        message_id: str,
+        correlation_id: str | None = None,
+        headers: dict[str, Any] | None = None,
+    ) -> None: ...
+
+    async def declare_bound_queue(self, queue_name: str, routing_key: str, **kwargs: Any) -> Any: ...
+
+    async def declare_payments_requests_queue(self) -> Any: ...
+
+    async def declare_payment_request_shard_queue(self, shard: int) -> Any: ...
+
+    async def retry_or_dead_letter(self, msg: Any, *, queue_name: str, error: Exception) -> None: ...
+
+    async def list_dead_letters(self, queue_name: str, *, limit: int) -> list[dict[str, Any]]: ...
+
+    async def replay_dead_letters(self, queue_name: str, *, limit: int) -> int: ...
+
+
+class QueueTopology(ABC):
+    @abstractmethod
+    async def declare_bound_queue(self, queue_name: str, routing_key: str, **kwargs: Any) -> Any: ...
+
+    async def declare_payments_requests_queue(self) -> Any:
+        return await self.declare_bound_queue(QUEUE_PAYMENTS_REQUESTS, RK_PAYMENT_REQUESTED)
+
+    async def declare_payment_request_shard_queue(self, shard: int) -> Any:
+        return await self.declare_bound_queue(
+            payment_request_queue_name(shard),
+            payment_request_routing_key(shard),
+            arguments={"x-single-active-consumer": True},
+        )
+
+
+class RabbitMQ(QueueTopology):
+    def __init__(
+        self,
+        url: str,
+        content_type: str = CONTENT_TYPE_JSON,
+        max_retries: int = 5,
+        retry_base_delay: float = 1.0,
+    ):
         self.url = url
+        self.content_type = content_type
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
         self._conn: aio_pika.RobustConnection | None = None
 
         self._pub_channel: aio_pika.abc.AbstractRobustChannel | None = None
@@ -31,7 +126,7 @@ class RabbitMQ:
             try:
                 self._conn = await aio_pika.connect_robust(self.url)
 
-                self._pub_channel = await self._conn.channel()
+                self._pub_channel = await self._conn.channel(on_return_raises=True)
                 self._pub_exchange = await self._pub_channel.declare_exchange(
                     EXCHANGE_NAME, ExchangeType.TOPIC, durable=True
                 )
@@ -52,6 +147,10 @@ class RabbitMQ:
         if self._conn:
             await self._conn.close()
 
+    async def check(self) -> None:
+        if self._conn is None or self._conn.is_closed:
+            raise RuntimeError("RabbitMQ connection is not open")
+
     async def publish_json(
         self,
         *,
@@ -60,12 +159,31 @@ class RabbitMQ:
         message_id: str,
         correlation_id: str | None = None,
         headers: dict[str, Any] | None = None,
+    ) -> None:
+        await self.publish_bytes(
+            routing_key=routing_key,
+            body=encode(body, self.content_type),
+            content_type=self.content_type,
+            message_id=message_id,
+            correlation_id=correlation_id,
+            headers=headers,
+        )
+
+    async def publish_bytes(
+        self,
+        *,
+        routing_key: str,
+        body: bytes,
+        content_type: str,
+        message_id: str,
+        correlation_id: str | None = None,
+        headers: dict[str, Any] | None = None,
     ) -> None:
         assert self._pub_exchange is not None
 
         msg = Message(
-            body=json.dumps(body).encode("utf-8"),
-            content_type="application/json",
+            body=body,
+            content_type=content_type,
             delivery_mode=DeliveryMode.PERSISTENT,
             message_id=message_id,
             correlation_id=correlation_id,
@@ -73,10 +191,128 @@ class RabbitMQ:
         )
         await self._pub_exchange.publish(msg, routing_key=routing_key)
 
-    async def declare_payments_requests_queue(self) -> aio_pika.abc.AbstractRobustQueue:
+    async def declare_bound_queue(
+        self,
+        queue_name: str,
+        routing_key: str,
+        *,
+        arguments: dict[str, Any] | None = None,
+        retry_topology: bool = True,
+    ) -> aio_pika.abc.AbstractRobustQueue:
         assert self._con_channel is not None
         assert self._con_exchange is not None
 
-        queue = await self._con_channel.declare_queue(QUEUE_PAYMENTS_REQUESTS, durable=True)
-        await queue.bind(self._con_exchange, routing_key=RK_PAYMENT_REQUESTED)
+        queue = await self._con_channel.declare_queue(queue_name, durable=True, arguments=arguments)
+        if retry_topology:
+            await self._declare_retry_topology(queue_name)
+        await queue.bind(self._con_exchange, routing_key=routing_key)
         return queue
+
+    def _retry_delays_ms(self) -> list[int]:
+        return [int(self.retry_base_delay * 1000 * 2 ** i) for i in range(self.max_retries)]
+
+    async def _declare_retry_topology(self, queue_name: str) -> None:
+        assert self._con_channel is not None
+
+        for delay_ms in self._retry_delays_ms():
+            await self._con_channel.declare_queue(
+                retry_queue_name(queue_name, delay_ms),
+                durable=True,
+                arguments={
+                    "x-message-ttl": delay_ms,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": queue_name,
+                },
+            )
+        await self._con_channel.declare_queue(dead_letter_queue_name(queue_name), durable=True)
+
+    async def retry_or_dead_letter(
+        self,
+        msg: aio_pika.abc.AbstractIncomingMessage,
+        *,
+        queue_name: str,
+        error: Exception,
+    ) -> None:
+        assert self._pub_channel is not None
+
+        headers = dict(msg.headers or {})
+        retries = int(headers.get(HEADER_RETRY_COUNT, 0))
+        headers[HEADER_LAST_ERROR] = f"{type(error).__name__}: {error}"[:1000]
+
+        if retries < self.max_retries:
+            headers[HEADER_RETRY_COUNT] = retries + 1
+            target = retry_queue_name(queue_name, self._retry_delays_ms()[retries])
+        else:
+            target = dead_letter_queue_name(queue_name)
+
+        await self._pub_channel.default_exchange.publish(_copy_message(msg, headers), routing_key=target)
+        await msg.ack()
+
+    async def _get_dead_letters(
+        self, queue_name: str, *, limit: int
+    ) -> list[aio_pika.abc.AbstractIncomingMessage]:
+        assert self._con_channel is not None
+
+        queue = await self._con_channel.declare_queue(dead_letter_queue_name(queue_name), durable=True)
+        messages: list[aio_pika.abc.AbstractIncomingMessage] = []
+        while len(messages) < limit:
+            msg = await queue.get(no_ack=False, fail=False)
+            if msg is None:
+                break
+            messages.append(msg)
+        return messages
+
+    async def list_dead_letters(self, queue_name: str, *, limit: int) -> list[dict[str, Any]]:
+        messages = await self._get_dead_letters(queue_name, limit=limit)
+        try:
+            return [_describe_message(msg) for msg in messages]
+        finally:
+            for msg in messages:
+                await msg.nack(requeue=True)
+
+    async def replay_dead_letters(self, queue_name: str, *, limit: int) -> int:
+        assert self._pub_channel is not None
+
+        messages = await self._get_dead_letters(queue_name, limit=limit)
+        replayed = 0
+        try:
+            for msg in messages:
+                headers = dict(msg.headers or {})
+                headers.pop(HEADER_RETRY_COUNT, None)
+                await self._pub_channel.default_exchange.publish(
+                    _copy_message(msg, headers), routing_key=queue_name
+                )
+                await msg.ack()
+                replayed += 1
+        finally:
+            for msg in messages[replayed:]:
+                await msg.nack(requeue=True)
+        return replayed
+
+
+def _copy_message(msg: aio_pika.abc.AbstractIncomingMessage, headers: dict[str, Any]) -> Message:
+    return Message(
+        body=msg.body,
+        content_type=msg.content_type,
+        delivery_mode=DeliveryMode.PERSISTENT,
+        message_id=msg.message_id,
+        correlation_id=msg.correlation_id,
+        headers=headers,
+    )
+
+
+def _describe_message(msg: aio_pika.abc.AbstractIncomingMessage) -> dict[str, Any]:
+    headers = msg.headers or {}
+    try:
+        body = decode(msg.body, msg.content_type)
+    except Exception:
+        body = None
+    return {
+        "message_id": msg.message_id,
+        "correlation_id": msg.correlation_id,
+        "event_type": headers.get("event_type"),
+        "retries": int(headers.get(HEADER_RETRY_COUNT, 0)),
+        "last_error": headers.get(HEADER_LAST_ERROR),
+        "body": body,
+    }
+
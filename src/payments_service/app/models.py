@@ -2,10 +2,13 @@ import enum
 import uuid
 from datetime import datetime
 
-from sqlalchemy import DateTime, Enum, Integer, Numeric, String, UniqueConstraint, func
+from sqlalchemy import BigInteger, DateTime, Enum, Index, Integer, LargeBinary, Numeric, String, UniqueConstraint, func, text
 from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
+from .config import settings
+from .partitioning import attach_hash_partitions, partition_by_user
+
 
 class Base(DeclarativeBase):
     pass
@@ -21,13 +24,23 @@ class TxKind(str, enum.Enum):
     order_debit = "order_debit"
 
 
+USER_PARTITIONS = settings.user_partitions
+
+# Unique keys of a partitioned table must contain the partition key.
+BALANCE_TX_ORDER_KEY = ("user_id", "order_id") if USER_PARTITIONS else ("order_id",)
+
+
 class Account(Base):
     __tablename__ = "accounts"
-    __table_args__ = (UniqueConstraint("user_id", name="uq_accounts_user_id"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", name="uq_accounts_user_id"),
+        partition_by_user(USER_PARTITIONS),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id: Mapped[str] = mapped_column(String(128), nullable=False, index=True)
+    user_id: Mapped[str] = mapped_column(String(128), primary_key=USER_PARTITIONS > 0, nullable=False, index=True)
     balance: Mapped[float] = mapped_column(Numeric(18, 2), nullable=False, default=0)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0, server_default=text("0"))
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -36,11 +49,12 @@ class Account(Base):
 class BalanceTransaction(Base):
     __tablename__ = "balance_transactions"
     __table_args__ = (
-        UniqueConstraint("order_id", name="uq_balance_tx_order_id"),
+        UniqueConstraint(*BALANCE_TX_ORDER_KEY, name="uq_balance_tx_order_id"),
+        partition_by_user(USER_PARTITIONS),
     )
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id: Mapped[str] = mapped_column(String(128), nullable=False, index=True)
+    user_id: Mapped[str] = mapped_column(String(128), primary_key=USER_PARTITIONS > 0, nullable=False, index=True)
     kind: Mapped[TxKind] = mapped_column(Enum(TxKind), nullable=False)
     amount: Mapped[float] = mapped_column(Numeric(18, 2), nullable=False)
 
@@ -49,6 +63,11 @@ class BalanceTransaction(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
 
+if USER_PARTITIONS:
+    attach_hash_partitions(Account.__table__, USER_PARTITIONS)
+    attach_hash_partitions(BalanceTransaction.__table__, USER_PARTITIONS)
+
+
 class Payment(Base):
     __tablename__ = "payments"
     __table_args__ = (UniqueConstraint("order_id", name="uq_payments_order_id"),)
@@ -65,18 +84,29 @@ class Payment(Base):
 
 class OutboxEvent(Base):
     __tablename__ = "outbox_events"
+    __table_args__ = (
+        Index(
+            "ix_outbox_events_pending",
+            "created_at",
+            postgresql_where=text("published_at IS NULL"),
+        ),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     event_type: Mapped[str] = mapped_column(String(128), nullable=False)
     aggregate_type: Mapped[str] = mapped_column(String(128), nullable=False)
     aggregate_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    routing_key: Mapped[str | None] = mapped_column(String(256), nullable=True)
 
-    payload: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    body: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    content_type: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    payload: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     published_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
     attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     last_error: Mapped[str | None] = mapped_column(String(1024), nullable=True)
 
 
@@ -85,3 +115,10 @@ class InboxMessage(Base):
 
     message_id: Mapped[str] = mapped_column(String(128), primary_key=True)
     received_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class ShardMember(Base):
+    __tablename__ = "shard_members"
+
+    member_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
@@ -1,54 +1,147 @@
-import asyncio
-from datetime import datetime, timezone
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any
 
-from sqlalchemy import select
+from sqlalchemy import func, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
 
+from .circuit_breaker import CircuitBreaker
+from .codec import encode
 from .config import settings
 from .db import SessionLocal
-from .messaging import RK_PAYMENT_RESULT, RabbitMQ
+from .drain import STAGE_PUBLISHERS, drain
+from .messaging import RK_PAYMENT_RESULT, MessageTransport
 from .models import OutboxEvent
 
 
+logger = logging.getLogger(__name__)
+
+
 def _utc_now() -> datetime:
     return datetime.now(timezone.utc)
 
 
-async def outbox_dispatcher(rmq: RabbitMQ) -> None:
-    while True:
+def _next_attempt_at(attempts: int) -> datetime:
+    delay = min(settings.outbox_backoff_base * 2 ** (attempts - 1), settings.outbox_backoff_max)
+    return _utc_now() + timedelta(seconds=delay)
+
+
+async def outbox_dispatcher(rmq: MessageTransport) -> None:
+    breaker = CircuitBreaker(
+        failure_threshold=settings.outbox_breaker_failure_threshold,
+        reset_timeout=settings.outbox_breaker_reset_timeout,
+    )
+    while not drain.draining(STAGE_PUBLISHERS):
+        if breaker.ready():
+            try:
+                async with SessionLocal() as session:
+                    await _dispatch_batch(session=session, rmq=rmq, breaker=breaker)
+            except Exception:
+                pass
+
+        await drain.sleep(settings.outbox_poll_interval, STAGE_PUBLISHERS)
+
+    # Final flush so events written by drained consumers go out before exit.
+    while breaker.ready():
         try:
             async with SessionLocal() as session:
-                await _dispatch_batch(session=session, rmq=rmq)
+                if await _dispatch_batch(session=session, rmq=rmq, breaker=breaker) < settings.outbox_batch_size:
+                    break
         except Exception:
-            pass
-
-        await asyncio.sleep(settings.outbox_poll_interval)
+            break
 
 
-async def _dispatch_batch(*, session: AsyncSession, rmq: RabbitMQ) -> None:
+async def _dispatch_batch(*, session: AsyncSession, rmq: MessageTransport, breaker: CircuitBreaker) -> int:
     stmt = (
         select(OutboxEvent)
-        .where(OutboxEvent.published_at.is_(None))
+        .options(defer(OutboxEvent.payload))
+        .where(
+            OutboxEvent.published_at.is_(None),
+            OutboxEvent.attempts < settings.outbox_max_attempts,
+            or_(OutboxEvent.next_attempt_at.is_(None), OutboxEvent.next_attempt_at <= _utc_now()),
+        )
         .order_by(OutboxEvent.created_at.asc())
         .limit(settings.outbox_batch_size)
     )
     res = await session.execute(stmt)
     events = list(res.scalars().all())
     if not events:
-        return
+        return 0
 
     for ev in events:
+        if not breaker.allow():
+            break
         try:
-            await rmq.publish_json(
-                routing_key=RK_PAYMENT_RESULT,
-                body=ev.payload,
+            if ev.body is not None:
+                body, content_type = ev.body, ev.content_type or rmq.content_type
+            else:
+                await session.refresh(ev, attribute_names=["payload"])
+                body, content_type = encode(ev.payload, rmq.content_type), rmq.content_type
+            await rmq.publish_bytes(
+                routing_key=ev.routing_key or RK_PAYMENT_RESULT,
+                body=body,
+                content_type=content_type,
                 message_id=str(ev.id),
                 correlation_id=ev.aggregate_id,
                 headers={"event_type": ev.event_type},
             )
             ev.published_at = _utc_now()
+            ev.next_attempt_at = None
+            breaker.record_success()
         except Exception as e:
             ev.attempts += 1
             ev.last_error = str(e)[:1000]
+            ev.next_attempt_at = _next_attempt_at(ev.attempts)
+            breaker.record_failure()
+            if ev.attempts >= settings.outbox_max_attempts:
+                logger.error(
+                    "outbox event %s (%s for %s) abandoned after %d attempts: %s",
+                    ev.id, ev.event_type, ev.aggregate_id, ev.attempts, ev.last_error,
+                )
 
     await session.commit()
+    return len(events)
+
+
+# Events the dispatcher gave up on stay in the table until an operator
+# re-arms them, so a long broker outage leaves a visible backlog instead of
+# silently dropping them.
+def _abandoned():
+    return OutboxEvent.published_at.is_(None), OutboxEvent.attempts >= settings.outbox_max_attempts
+
+
+async def count_abandoned(session: AsyncSession) -> int:
+    return await session.scalar(select(func.count()).select_from(OutboxEvent).where(*_abandoned()))
+
+
+async def list_abandoned(session: AsyncSession, *, limit: int) -> list[dict[str, Any]]:
+    res = await session.execute(
+        select(
+            OutboxEvent.id,
+            OutboxEvent.event_type,
+            OutboxEvent.aggregate_id,
+            OutboxEvent.attempts,
+            OutboxEvent.last_error,
+            OutboxEvent.created_at,
+        )
+        .where(*_abandoned())
+        .order_by(OutboxEvent.created_at.asc())
+        .limit(limit)
+    )
+    return [dict(row) for row in res.mappings()]
+
+
+async def rearm_abandoned(session: AsyncSession, *, limit: int) -> int:
+    ids = (
+        select(OutboxEvent.id)
+        .where(*_abandoned())
+        .order_by(OutboxEvent.created_at.asc())
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    res = await session.execute(
+        update(OutboxEvent).where(OutboxEvent.id.in_(ids)).values(attempts=0, next_attempt_at=None)
+    )
+    return res.rowcount or 0
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import logging
+import sys
+import uuid
+
+from .db import engine
+from .models import USER_PARTITIONS, Base
+from .partitioning import OnlinePartitioner, is_partitioned, partitioned_tables, scanned_partitions
+
+
+PRUNING_CHECKS = (
+    ("accounts", "get_balance", "SELECT * FROM accounts WHERE user_id = :user_id"),
+    ("accounts", "get_account_for_update", "SELECT * FROM accounts WHERE user_id = :user_id FOR UPDATE"),
+    (
+        "accounts",
+        "topup",
+        "UPDATE accounts SET balance = balance + 1 WHERE id = CAST(:row_id AS uuid) AND user_id = :user_id",
+    ),
+    ("balance_transactions", "ledger", "SELECT * FROM balance_transactions WHERE user_id = :user_id"),
+)
+
+
+async def migrate(args: argparse.Namespace) -> None:
+    for table in partitioned_tables(Base.metadata):
+        if args.table and table.name not in args.table:
+            continue
+        await OnlinePartitioner(engine, table, USER_PARTITIONS).run(
+            batch_size=args.batch_size,
+            pause=args.pause,
+            drop_old=args.drop_old,
+            lock_timeout=args.lock_timeout,
+        )
+
+
+async def check(args: argparse.Namespace) -> bool:
+    params = {"user_id": args.user_id, "row_id": str(uuid.uuid4())}
+    ok = True
+    async with engine.connect() as conn:
+        for table, name, stmt in PRUNING_CHECKS:
+            if not await is_partitioned(conn, table):
+                print(f"{name}: {table} is not partitioned")
+                ok = False
+                continue
+            scanned = await scanned_partitions(conn, table, stmt, params)
+            pruned = len(scanned) <= 1
+            ok = ok and pruned
+            print(f"{name}: {'ok' if pruned else 'NOT PRUNED'} ({', '.join(sorted(scanned)) or 'no partitions'})")
+    return ok
+
+
+async def run(args: argparse.Namespace) -> int:
+    try:
+        if args.command == "check":
+            return 0 if await check(args) else 1
+        await migrate(args)
+        return 0
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Hash-partition user-keyed tables by user_id")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    m = sub.add_parser("migrate", help="Online backfill of existing unpartitioned tables")
+    m.add_argument("--table", action="append", help="Only migrate this table (repeatable)")
+    m.add_argument("--batch-size", type=int, default=5000)
+    m.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches")
+    m.add_argument("--lock-timeout", type=float, default=5.0, help="Lock timeout for the final rename")
+    m.add_argument("--drop-old", action="store_true", help="Drop the unpartitioned table after the swap")
+
+    c = sub.add_parser("check", help="EXPLAIN the user-scoped queries and verify they hit one partition")
+    c.add_argument("--user-id", default="partition-check")
+
+    args = parser.parse_args()
+    if USER_PARTITIONS <= 0:
+        sys.exit("USER_PARTITIONS must be set to the number of partitions")
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,7 @@
+from datetime import datetime
 from decimal import Decimal
+from typing import Any
+from uuid import UUID
 
 from pydantic import BaseModel, Field
 
@@ -20,3 +23,39 @@ class TopUpResponse(BaseModel):
 class BalanceResponse(BaseModel):
     user_id: str
     balance: str
+
+
+class DeadLetter(BaseModel):
+    message_id: str | None
+    correlation_id: str | None
+    event_type: str | None
+    retries: int
+    last_error: str | None
+    body: Any
+
+
+class DeadLetterListResponse(BaseModel):
+    queue: str
+    messages: list[DeadLetter]
+
+
+class DeadLetterReplayResponse(BaseModel):
+    queue: str
+    replayed: int
+
+
+class AbandonedOutboxEvent(BaseModel):
+    id: UUID
+    event_type: str
+    aggregate_id: str
+    attempts: int
+    last_error: str | None
+    created_at: datetime
+
+
+class AbandonedOutboxListResponse(BaseModel):
+    events: list[AbandonedOutboxEvent]
+
+
+class AbandonedOutboxRearmResponse(BaseModel):
+    rearmed: int
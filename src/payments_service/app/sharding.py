@@ -0,0 +1,54 @@
+import hashlib
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .config import settings
+from .db import SessionLocal
+from .models import ShardMember
+
+
+def _weight(member_id: str, shard: int) -> int:
+    digest = hashlib.blake2b(f"{member_id}:{shard}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def assign_shards(member_id: str, members: list[str], shards: int) -> set[int]:
+    if member_id not in members:
+        members = [*members, member_id]
+    return {
+        shard
+        for shard in range(shards)
+        if max(members, key=lambda m: _weight(m, shard)) == member_id
+    }
+
+
+async def claim_shards(member_id: str) -> set[int]:
+    async with SessionLocal() as session:
+        async with session.begin():
+            stmt = insert(ShardMember).values(member_id=member_id, heartbeat_at=func.now())
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ShardMember.member_id],
+                set_={"heartbeat_at": stmt.excluded.heartbeat_at},
+            )
+            await session.execute(stmt)
+            await session.execute(
+                delete(ShardMember).where(
+                    ShardMember.heartbeat_at < func.now() - timedelta(seconds=settings.shard_member_ttl * 10)
+                )
+            )
+            res = await session.execute(
+                select(ShardMember.member_id).where(
+                    ShardMember.heartbeat_at >= func.now() - timedelta(seconds=settings.shard_member_ttl)
+                )
+            )
+            members = sorted(res.scalars().all())
+
+    return assign_shards(member_id, members, settings.payment_request_shards)
+
+
+async def release_shards(member_id: str) -> None:
+    async with SessionLocal() as session:
+        async with session.begin():
+            await session.execute(delete(ShardMember).where(ShardMember.member_id == member_id))
@@ -0,0 +1,53 @@
+import asyncio
+import signal
+
+from .config import settings
+from .consumer import payment_requested_consumer
+from .db import init_db
+from .drain import STAGE_PUBLISHERS, drain
+from .loop_monitor import loop_monitor
+from .messaging import MessageTransport, RabbitMQ
+from .outbox import outbox_dispatcher
+
+
+def create_rmq() -> MessageTransport:
+    return RabbitMQ(
+        settings.rabbitmq_url,
+        content_type=settings.message_content_type,
+        max_retries=settings.consumer_max_retries,
+        retry_base_delay=settings.consumer_retry_base_delay,
+    )
+
+
+def start_background_tasks(rmq: MessageTransport) -> list[asyncio.Task]:
+    return [
+        drain.track(asyncio.create_task(outbox_dispatcher(rmq)), STAGE_PUBLISHERS),
+        drain.track(asyncio.create_task(payment_requested_consumer(rmq))),
+    ]
+
+
+async def run() -> None:
+    rmq = create_rmq()
+    await asyncio.gather(init_db(), rmq.connect())
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    tasks = start_background_tasks(rmq)
+    if settings.loop_monitor_enabled:
+        tasks.append(asyncio.create_task(loop_monitor.run()))
+    stop_task = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait([stop_task, *tasks], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        await drain.drain(settings.shutdown_drain_timeout)
+        for t in [stop_task, *tasks]:
+            t.cancel()
+        await asyncio.gather(stop_task, *tasks, return_exceptions=True)
+        await rmq.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())